@@ -10,10 +10,17 @@ parser.add_argument('-v','--version',help='Show FGO-py version',action='version'
 parser.add_argument('-l','--loglevel',help='Change the console log level (default: %(default)s)',type=str.upper,choices=['DEBUG','INFO','WARNING','CRITICAL','ERROR'],default='INFO')
 parser.add_argument('-c','--config',help='Config file path (default: %(default)s)',type=str,default='fgoConfig.json')
 parser.add_argument('--no-color',help='Disable colored console output',action='store_true')
+parser.add_argument('--profile-startup',help='Profile every startup stage, save the report as json and exit',action='store_true')
+parser.add_argument('--profile-output',help='Startup profile report path (default: fgoLog/Startup_<time>.json)',metavar='FILE',type=str,default='')
 arg=parser.parse_args()
 
 if arg.no_color:os.environ['NO_COLOR']='1'
 
+if arg.profile_startup:
+    from fgoProfile import profile
+    profile(arg.entrypoint,arg.profile_output)
+    sys.exit()
+
 match arg.entrypoint:
     case'gui':from fgoGui import main
     case'cli':from fgoCli import main
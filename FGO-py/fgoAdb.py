@@ -0,0 +1,90 @@
+import os,shlex,socket,threading
+from airtest.core.error import AdbError,AdbShellError
+
+def recv(sock,size):
+    view=memoryview(buffer:=bytearray(size))
+    while view:
+        if not(n:=sock.recv_into(view)):raise ConnectionError('Connection closed by adb')
+        view=view[n:]
+    return buffer
+def send(sock,msg):sock.sendall(b'%04x%s'%(len(msg),msg))
+def connect(addr,serial,service,timeout=None):
+    # Speak the adb protocol to the local server directly: pick the device, then open the service on it
+    sock=socket.create_connection(addr,timeout)
+    for i in(f'host:transport:{serial}',service):
+        send(sock,i.encode())
+        if recv(sock,4)!=b'OKAY':
+            with sock:raise ConnectionError(f'{i}: {recv(sock,int(recv(sock,4),16)).decode(errors="replace")}')
+    return sock
+
+class Session:
+    # A long-lived exec:sh, each command followed by a printf of a random sentinel and its exit status, which marks where its output ends
+    # Commands run in a subshell, so that neither an exit nor a cd leaks into the session, and exec has no pty, so output comes back byte for byte
+    # stderr goes to a file of the session instead, sent before the status only when the command failed, so a success is answered in one write
+    def __init__(self,addr,serial,timeout=30):
+        self.sock=connect(addr,serial,'exec:sh',timeout)
+        self.sock.sendall(b'err=${TMPDIR:-/data/local/tmp}/.fgo.%s.err\n'%os.urandom(8).hex().encode())
+    def read(self,data,mark,start):
+        while(end:=data.find(mark,start))<0 or(eol:=data.find(b'\n',end+len(mark)))<0:
+            if end<0:start=max(start,len(data)-len(mark)+1) # only the tail can hold a sentinel split between chunks
+            if not(chunk:=self.sock.recv(1<<20)):raise ConnectionError('Connection closed by adb')
+            data+=chunk
+        return end,eol
+    def __call__(self,cmd):
+        token=os.urandom(8).hex().encode()
+        self.sock.sendall(b'( %s\n) </dev/null 2>"$err"\ns=$?\n[ $s = 0 ] || { printf "\\n%s -\\n"; cat "$err"; }\nprintf "\\n%s %%d\\n" $s\n'%(cmd.encode()if isinstance(cmd,str)else cmd,token,token))
+        data=bytearray()
+        end,eol=self.read(data,mark:=b'\n%s '%token,0)
+        stderr=b''
+        if data[end+len(mark):eol]==b'-':
+            tail,last=self.read(data,mark,eol)
+            stderr=bytes(data[eol+1:tail])
+            eol=last
+        status=int(data[data.rfind(b' ',0,eol)+1:eol])
+        del data[end:]
+        return data,status,stderr
+    def close(self):
+        try:self.sock.sendall(b'rm -f "$err"\n') # the stderr file outlives the shell otherwise
+        except OSError:pass
+        self.sock.close()
+
+class Pool:
+    # Shell sessions shared by all shell traffic of a device, instead of an adb client process per command
+    # A request borrows an idle session or opens a new one, so concurrent requests run side by side, and at most size sessions are kept
+    # A session found broken is dropped and the request is retried once on a fresh one
+    def __init__(self,serial,addr=('127.0.0.1',5037),size=4,timeout=30):
+        self.serial=serial
+        self.addr=addr
+        self.size=size
+        self.timeout=timeout
+        self.idle=[]
+        self.lock=threading.Lock()
+    def run(self,cmd):
+        for retry in range(2):
+            with self.lock:session=self.idle.pop()if self.idle else None
+            try:
+                session=session or Session(self.addr,self.serial,self.timeout)
+                result=session(cmd)
+            except TimeoutError: # a hung command is not run a second time
+                if session:session.close()
+                raise
+            except OSError:
+                if session:session.close()
+                if retry:raise
+            else:break
+        with self.lock:
+            if keep:=len(self.idle)<self.size:self.idle.append(session)
+        if not keep:session.close()
+        return result
+    # Drop-ins for airtest ADB.shell and ADB.raw_shell, raising the same errors on a failed command
+    def shell(self,cmd):
+        output,status,stderr=self.run(shlex.join(cmd)if isinstance(cmd,(list,tuple))else cmd)
+        if status:raise AdbShellError(output.decode(errors='replace'),stderr.decode(errors='replace'))
+        return output.decode(errors='replace')
+    def raw_shell(self,cmd,ensure_unicode=True):
+        output,status,stderr=self.run(shlex.join(cmd)if isinstance(cmd,(list,tuple))else cmd)
+        if status:raise AdbError(output.decode(errors='replace'),stderr.decode(errors='replace'))
+        return output.decode(errors='replace')if ensure_unicode else bytes(output)
+    def close(self):
+        with self.lock:idle,self.idle=self.idle,[]
+        for i in idle:i.close()
@@ -0,0 +1,53 @@
+import os,socket,subprocess,tempfile,threading
+from fgoAdb import recv
+
+class FakeServer:
+    # A stand-in adb server with a single device, services running in the local sh, to verify Pool without a device
+    # prelude is run by each shell first, e.g. to define a screencap function, and kill drops every connection the way an adb restart does
+    def __init__(self,serial='fake',prelude=''):
+        self.serial=serial
+        self.prelude=prelude
+        self.conn=set()
+        self.count=0
+        self.server=socket.create_server(('127.0.0.1',0))
+        self.addr=self.server.getsockname()
+        threading.Thread(target=self.accept,daemon=True,name='FakeAdb').start()
+    def accept(self):
+        while True:
+            try:conn,_=self.server.accept()
+            except OSError:return
+            self.conn.add(conn)
+            threading.Thread(target=self.handle,args=(conn,),daemon=True).start()
+    def handle(self,conn):
+        try:
+            with conn:
+                if(msg:=recv(conn,int(recv(conn,4),16)).decode())!=f'host:transport:{self.serial}':return conn.sendall(b'FAIL%04x%s'%(len(err:=f'device \'{msg[15:]}\' not found'.encode()),err))
+                conn.sendall(b'OKAY')
+                if not(msg:=recv(conn,int(recv(conn,4),16)).decode()).startswith('exec:'):return conn.sendall(b'FAIL%04x%s'%(len(err:=b'unsupported service'),err))
+                conn.sendall(b'OKAY')
+                self.count+=1
+                proc=subprocess.Popen(['sh']if msg=='exec:sh'else['sh','-c',f'{self.prelude}\n{msg[5:]}'],stdin=subprocess.PIPE,stdout=subprocess.PIPE,env=os.environ|{'TMPDIR':tempfile.gettempdir()})
+                if msg=='exec:sh':proc.stdin.write(f'{self.prelude}\n'.encode())
+                def pump():
+                    try:
+                        while data:=conn.recv(65536):
+                            proc.stdin.write(data)
+                            proc.stdin.flush()
+                    except OSError:pass
+                    finally:proc.stdin.close()
+                threading.Thread(target=pump,daemon=True).start()
+                try:
+                    while data:=proc.stdout.read1(65536):conn.sendall(data)
+                except OSError:pass
+                finally:
+                    proc.kill()
+                    conn.shutdown(socket.SHUT_RDWR)
+        except(OSError,ValueError):pass
+        finally:self.conn.discard(conn)
+    def kill(self):
+        for i in list(self.conn):
+            try:i.shutdown(socket.SHUT_RDWR)
+            except OSError:pass
+    def close(self):
+        self.server.close()
+        self.kill()
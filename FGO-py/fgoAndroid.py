@@ -1,8 +1,10 @@
-import re,shutil,threading,time,cv2,numpy
+import re,shutil,struct,threading,time,cv2,numpy
 from airtest.core.android.adb import ADB
 from airtest.core.android.android import Android as Airtest
 from airtest.core.android.constant import CAP_METHOD
+from fgoAdb import Pool
 from fgoConst import KEYMAP
+from fgoStream import Screenrecord,Stream
 from fgoLogging import getLogger
 logger=getLogger('Android')
 
@@ -10,25 +12,77 @@ if adb:=shutil.which('adb'):
     logger.warning(f'Using Adb in PATH: {adb}')
     ADB.builtin_adb_path=staticmethod(lambda:adb)
 
+class Frame:
+    # A capture kept at native resolution, each rect of the 1280x720 space converted only when asked for, through the mapping touch uses
+    # Tiles are resampled like cv2.resize with INTER_CUBIC would, and cached, so the whole frame is converted only by those who need all of it
+    # A raw framebuffer is kept in its own pixel format as well, code being the cv2.cvtColor conversion each tile goes through
+    shape=(720,1280,3)
+    def __init__(self,raw,scale,offset,stamp=None,code=None):
+        self.raw=raw
+        self.stamp=stamp
+        self.code=code
+        self.scale=scale
+        self.offset=offset
+        self.tile={}
+    def crop(self,rect):
+        if(rect:=tuple(rect))in self.tile:return self.tile[rect]
+        if(full:=self.tile.get((0,0,1280,720)))is not None:return full[rect[1]:rect[3],rect[0]:rect[2]]
+        if self.scale==1 and all(isinstance(i,int)for i in self.offset):tile=self.raw[rect[1]+self.offset[1]:rect[3]+self.offset[1],rect[0]+self.offset[0]:rect[2]+self.offset[0]]
+        else:tile=cv2.warpAffine(self.raw,numpy.float64([[1/self.scale,0,(rect[0]+.5)/self.scale-.5+self.offset[0]],[0,1/self.scale,(rect[1]+.5)/self.scale-.5+self.offset[1]]]),(rect[2]-rect[0],rect[3]-rect[1]),flags=cv2.INTER_CUBIC|cv2.WARP_INVERSE_MAP,borderMode=cv2.BORDER_REPLICATE)
+        if self.code is not None:tile=cv2.cvtColor(tile,self.code)
+        return self.tile.setdefault(rect,tile)
+    @property
+    def image(self):return self.crop((0,0,1280,720))
+
+class Screencap:
+    # screencap without -p through a pooled shell, no png encoded on the device nor decoded here
+    # The output is received into a single buffer and wrapped by numpy as it is, Frame converts it tile by tile
+    # Its length is exact thanks to the session sentinel, so the header, 12 or 16 bytes depending on the android version, needs no probing
+    code={1:cv2.COLOR_RGBA2BGR,2:cv2.COLOR_RGBA2BGR,5:cv2.COLOR_BGRA2BGR} # RGBA_8888, RGBX_8888, BGRA_8888
+    def __init__(self,pool):self.pool=pool
+    def __call__(self):
+        w,h,format=struct.unpack('<3I',(data:=self.pool.run('screencap 2>/dev/null')[0])[:12])
+        if format not in self.code or len(data)<w*h*4+12:raise ValueError(f'Unexpected screencap output: {w}x{h} format {format}, {len(data)} bytes')
+        return numpy.frombuffer(data,numpy.uint8,w*h*4,len(data)-w*h*4).reshape(h,w,4),self.code[format]
+
 class Android(Airtest):
-    def __init__(self,serial=None,**kwargs):
+    foreground=True
+    watchInterval=2
+    watchRetry=5
+    def __init__(self,serial=None,stream=False,**kwargs):
         self.mutex=threading.Lock()
+        self.wake=threading.Event()
+        self.closed=threading.Event()
+        self.pool=None
+        self.stream=None
+        self.screencap=None
         if serial is None or serial=='None':
             self.name=None
             return
         try:
             # 尝试使用 ADBCAP 截图方法，JAVACAP 在某些模拟器上方向有问题
             super().__init__(serial,**{'cap_method':CAP_METHOD.ADBCAP}|kwargs)
+            self.pool=Pool(self.serialno,(self.adb.host,self.adb.port))
+            try:self.pool.run('true')
+            except OSError as e:logger.warning(f'Shell sessions unavailable, fallback to adb client: {e!r}')
+            else:self.adb.shell,self.adb.raw_shell=self.pool.shell,self.pool.raw_shell # airtest itself goes through the pool from now on as well
             self.package=next(i for i in re.findall(r'ACTIVITY ([A-Za-z0-9_.]+)/',self.adb.shell('dumpsys activity top'))[::-1]if(lambda x:x[2]-x[0]>959 and x[3]-x[1]>539)(self.get_render_resolution(True,i)))
             self.adjustOffset()
-            self.rotation_watcher.reg_callback(lambda _:self.adjustOffset())
+            self.rotation_watcher.reg_callback(lambda _:(self.adjustOffset(),self.wake.set())) # a rotation is often the game being switched away, recheck at once
         except Exception as e:
             logger.exception(e)
             self.name=None
-        else:self.name=self.serialno
+        else:
+            self.name=self.serialno
+            if stream:self.stream=Stream(lambda:Screenrecord(self.adb),self.name)
+            else:
+                try:(screencap:=Screencap(self.pool))()
+                except Exception as e:logger.warning(f'Raw screencap unavailable, fallback to airtest: {e!r}')
+                else:self.screencap=screencap
+            threading.Thread(target=self.watchForeground,daemon=True,name=f'Foreground_{self.name}').start()
     @property
     def available(self):
-        if not self.name:return False
+        if not self.name or self.stream and not self.stream.available:return False
         if self.touch_proxy.server_proc.poll()is None:return True # Only compatible with minitouch & maxtouch
         self.name=None
         return False
@@ -67,26 +121,45 @@ class Android(Airtest):
         with self.mutex:super().touch(self.key[key])
     def pinch(self):
         with self.mutex:super().pinch(percent=.2)
+    def isForeground(self):return self.package in self.adb.shell('dumpsys activity top | grep ACTIVITY | tail -1')
+    def watchForeground(self):
+        # Poll the top activity off the capture path, so that a screenshot only pays for adb when the game has lost focus
+        # The watch ends with the device, or after watchRetry failures in a row, leaving the check to each screenshot again
+        failure=0
+        while not self.closed.is_set():
+            try:
+                self.foreground=self.isForeground()
+                failure=0
+            except Exception as e:
+                if(failure:=failure+1)>=self.watchRetry:
+                    self.foreground=False
+                    return logger.warning(f'Stop watching foreground app after {failure} failures: {e!r}')
+            self.wake.wait(self.watchInterval)
+            self.wake.clear()
+    def close(self):
+        self.closed.set()
+        self.wake.set()
+        if self.stream:self.stream.close()
+        if self.pool:self.pool.close()
     def bringToFront(self):
         """将游戏切换到前台"""
+        if self.foreground:return
         try:
-            top_activity=self.adb.shell('dumpsys activity top | grep ACTIVITY | tail -1')
-            if self.package not in top_activity:
+            if not self.isForeground(): # the flag may be stale, confirm before relaunching
                 self.adb.shell(f'monkey -p {self.package} -c android.intent.category.LAUNCHER 1')
                 time.sleep(1.0)
+            self.foreground=True
         except Exception as e:
             logger.warning(f'Failed to bring app to front: {e}')
     def screenshot(self):
         self.bringToFront()
-        img=super().snapshot()
-        h,w=img.shape[:2]
+        code=None
+        if self.stream:stamp,img=self.stream.get()
+        elif self.screencap:stamp,(img,code)=time.time(),self.screencap()
+        else:stamp,img=time.time(),super().snapshot()
         # 如果截图是竖屏，旋转为横屏
-        if h>w:
-            img=cv2.rotate(img,cv2.ROTATE_90_CLOCKWISE)
-        # render 格式是 [left, top, right, bottom]
-        left,top,right,bottom=self.render
-        crop=img[top:bottom,left:right]
-        return cv2.resize(crop,(1280,720),interpolation=cv2.INTER_CUBIC)
+        if img.shape[0]>img.shape[1]:img=cv2.rotate(img,cv2.ROTATE_90_CLOCKWISE)
+        return Frame(img,self.scale,[self.border[i]+self.render[i]for i in range(2)],stamp,code)
     def invoke169(self):
         x,y=(lambda r:(int(r.group(1)),int(r.group(2))))(re.search(r'(\d+)x(\d+)',self.adb.raw_shell('wm size')))
         if x*16<y*9:self.adb.raw_shell('wm size %dx%d'%(x,x*16//9))
@@ -0,0 +1,159 @@
+import hashlib,json,mmap,os,struct,threading,cv2,numpy
+from concurrent.futures import ThreadPoolExecutor
+from fgoLogging import getLogger
+logger=getLogger('Asset')
+
+executor=ThreadPoolExecutor(min(8,os.cpu_count()or 1),'Asset') # cv2 releases the GIL while decoding and resizing
+def parallel(func,iterable):return list((map if threading.current_thread().name.startswith('Asset_')else executor.map)(func,iterable)) # nested calls run inline so that a saturated pool never waits on itself
+
+def splitAlpha(x):return x[...,:3],x[...,3]if x.shape[2]>3 and x[...,3].min()<255 else None # no mask for opaque images, so that matchTemplate keeps its fast unmasked path
+
+class Bundle:
+    # A json header followed by aligned raw arrays, the on-disk format shared by AssetPack and Pyramid
+    # Identical arrays are written once and every key pointing at them gets the very same read-only view
+    magic=b'FGOASSET'
+    align=64
+    version=2
+    mapped=True
+    def __init__(self,file):
+        self.file=file
+        self.buffer=None
+        self.array={}
+        self.index={}
+        self.intern={}
+        self.shared=0
+        self.lock=threading.Lock()
+    def header(self):
+        # The json header alone, read without mapping the file, so that a stale pack is never mapped before it is replaced
+        if not os.path.isfile(self.file)or not os.path.getsize(self.file):return None
+        with open(self.file,'rb')as f:
+            if f.read(8)!=self.magic:return None
+            size,=struct.unpack('<Q',f.read(8))
+            return header if(header:=json.loads(f.read(size))).get('version')==self.version else None
+    def load(self):
+        if not os.path.isfile(self.file)or not os.path.getsize(self.file):return None
+        with open(self.file,'rb')as f:buffer=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)if self.mapped else f.read()
+        if buffer[:8]!=self.magic:return None
+        size,=struct.unpack('<Q',buffer[8:16])
+        if(header:=json.loads(buffer[16:16+size])).get('version')!=self.version:return None
+        base=-(-(16+size)//self.align)*self.align
+        self.buffer=buffer
+        self.index=header['index']
+        view={}
+        self.array={k:view[v['offset']]if v['offset']in view else view.setdefault(v['offset'],numpy.frombuffer(buffer,numpy.dtype(v['dtype']),numpy.prod(v['shape']),base+v['offset']).reshape(v['shape']))for k,v in self.index.items()}
+        return header
+    def save(self,array,meta={},**header):
+        # Returns whether the file was written, in which case the arrays are served from it
+        if isinstance(self.buffer,mmap.mmap): # a mapped file cannot be replaced on windows, so its views are dropped first
+            self.array,self.index={},{}
+            try:self.buffer.close()
+            except BufferError:pass
+        index={}
+        unique={}
+        offset=0
+        for k,v in array.items():
+            if(digest:=self.fingerprint(v))not in unique:
+                unique[digest]=offset,v
+                offset+=-(-v.nbytes//self.align)*self.align
+            index[k]={'offset':unique[digest][0],'shape':v.shape,'dtype':v.dtype.str}|meta.get(k,{})
+        header=json.dumps({'version':self.version,'index':index}|header,separators=(',',':')).encode()
+        try:
+            with open(tmp:=f'{self.file}.{os.getpid()}.tmp','wb')as f:
+                f.write(self.magic+struct.pack('<Q',len(header))+header)
+                f.write(bytes(-f.tell()%self.align))
+                for _,i in unique.values():
+                    f.write(numpy.ascontiguousarray(i).data)
+                    f.write(bytes(-f.tell()%self.align))
+            os.replace(tmp,self.file)
+        except OSError as e:
+            logger.warning(f'Failed to save {self.file}: {e!r}')
+            if os.path.isfile(tmp):os.remove(tmp)
+            return False
+        self.load()
+        logger.info(f'Saved {self.file}: {(stat:=self.stat())["array"]} arrays, {stat["unique"]} unique, {stat["saved"]/1048576:.1f}MiB deduplicated')
+        return True
+    @staticmethod
+    def fingerprint(array):return array.shape,array.dtype.str,hashlib.sha1(numpy.ascontiguousarray(array).data).digest()
+    def share(self,array):
+        # Intern arrays that do not come from the file, so equal content is held once in memory as well
+        if array is None:return None
+        with self.lock:
+            if(digest:=self.fingerprint(array))not in self.intern:
+                array.flags.writeable=False
+                self.intern[digest]=array
+            elif self.intern[digest]is not array:self.shared+=array.nbytes
+            return self.intern[digest]
+    def stat(self):
+        size=lambda x:int(numpy.prod(x['shape']))*numpy.dtype(x['dtype']).itemsize
+        unique={v['offset']:size(v)for v in self.index.values()}
+        intern=sum(i.nbytes for i in self.intern.values())
+        return{'array':len(self.index)+len(self.intern),'unique':len(unique)+len(self.intern),'size':sum(unique.values())+intern,'saved':sum(size(v)for v in self.index.values())-sum(unique.values())+self.shared}
+
+class AssetPack(Bundle):
+    # Every png under root is decoded once into a single uncompressed file, which is then mapped read-only, so startup is a mmap plus a dict of zero-copy views and all FGO-py processes on the host share the same physical pages
+    # The pack remembers size and mtime of its sources and is rebuilt as soon as any of them changes
+    def __init__(self,root='fgoImage',file='fgoTemp/fgoAsset.bin',exclude=('friend','mail')):
+        super().__init__(file)
+        self.root=root
+        self.exclude=exclude
+        self.digest={}
+        try:
+            if(source:=self.scan())!=(self.header()or{}).get('source'):self.build(source)
+            else:self.digest={k:v['hash']for k,v in self.load()['index'].items()}
+        except Exception as e:
+            logger.warning(f'Asset pack unavailable, fallback to png: {e!r}')
+            self.array={}
+            self.digest={}
+    def key(self,path):return os.path.relpath(path,self.root).replace(os.sep,'/')
+    def hash(self,path):
+        if(digest:=self.digest.get(self.key(path)))is None:
+            with open(path,'rb')as f:digest=hashlib.sha1(f.read()).hexdigest()
+        return digest
+    def scan(self):
+        source={}
+        for root,dirs,files in os.walk(self.root):
+            dirs[:]=sorted(i for i in dirs if self.key(os.path.join(root,i))not in self.exclude)
+            for i in sorted(i for i in files if i.endswith('.png')):
+                stat=os.stat(path:=os.path.join(root,i))
+                source[self.key(path)]=[stat.st_size,stat.st_mtime_ns]
+        return source
+    def build(self,source):
+        logger.warning('Building asset pack')
+        def read(path):
+            with open(os.path.join(self.root,path),'rb')as f:data=f.read()
+            return cv2.imdecode(numpy.frombuffer(data,numpy.uint8),cv2.IMREAD_UNCHANGED),hashlib.sha1(data).hexdigest()
+        array,digest=zip(*parallel(read,source))if source else((),())
+        self.digest=dict(zip(source,digest))
+        if not self.save(dict(zip(source,array)),{k:{'hash':v}for k,v in self.digest.items()},source=source):self.array,self.index={},{} # an unsaved pack is not held decoded in memory, each png is read on demand instead
+    def imread(self,path,flags=cv2.IMREAD_COLOR):
+        if(img:=self.array.get(self.key(path)))is not None:
+            match flags,img.ndim:
+                case cv2.IMREAD_UNCHANGED,_:return img
+                case cv2.IMREAD_COLOR,3:return img[...,:3]
+                case cv2.IMREAD_COLOR,2:return cv2.cvtColor(img,cv2.COLOR_GRAY2BGR)
+        return self.share(cv2.imread(path,flags))
+    def listdir(self,path):return[i for i in os.listdir(path)if i.endswith('.png')]
+    def imreadDir(self,path,flags=cv2.IMREAD_COLOR):return dict(zip(file:=self.listdir(path),(map if self.array else parallel)(lambda i:self.imread(f'{path}/{i}',flags),file)))
+asset=AssetPack()
+
+class Pyramid(Bundle):
+    # Rescaled assets, keyed by the hash of their source and the scale, so a variant is computed once and dropped only when its source changes
+    # The file is small and is read rather than mapped, so it can be rewritten while the arrays are in use
+    mapped=False
+    def __init__(self,pack,file='fgoTemp/fgoAssetScale.bin'):
+        super().__init__(file)
+        self.pack=pack
+        try:self.load()
+        except Exception as e:logger.warning(f'Scaled asset cache unavailable: {e!r}')
+    def __getitem__(self,key):return self.resize([key])[0]
+    def resize(self,item):
+        key=[f'{self.pack.hash(path)}@{scale:g}'for path,scale in item]
+        if miss:={k:v for k,v in zip(key,item)if k not in self.array}:
+            logger.info(f'Resize {len(miss)} assets')
+            array=dict(zip(miss,parallel(lambda x:cv2.resize(self.pack.imread(x[0],cv2.IMREAD_UNCHANGED),(0,0),fx=x[1],fy=x[1],interpolation=cv2.INTER_CUBIC),miss.values())))
+            with self.lock:
+                array=self.array|array
+                if live:=set(self.pack.digest.values()):array={k:v for k,v in array.items()if k.partition('@')[0]in live}
+                if not self.save(array):self.array=array # the variants are few and small, so they are kept in memory until a save succeeds
+        return[self.array[i]for i in key]
+pyramid=Pyramid(asset)
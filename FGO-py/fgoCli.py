@@ -1,6 +1,7 @@
-import argparse,cmd,json,os,platform,re,signal,time
+import argparse,cmd,json,os,platform,re,signal,tempfile,time
 import fgoDevice
 import fgoKernel
+from fgoDetect import XDetectBase
 from functools import reduce,wraps
 from fgoLogging import getLogger,color
 from fgoTeamupParser import IniParser
@@ -60,9 +61,27 @@ Some commands support <command> [<subcommand> ...] {{-h, --help}} for further in
     def do_bench(self,line):
         'Benchmark'
         arg=parser_bench.parse_args(line.split())
+        if arg.pyramid:
+            with tempfile.TemporaryDirectory()as temp:result=fgoKernel.verifyPyramid(arg.file or fgoKernel.synthesizePyramid(temp))
+            return logger.warning(f'Verify pyramid: {len(result["mismatch"])} mismatches, {result["full"]:.2f}ms -> {result["pyramid"]:.2f}ms')
+        if arg.adb:
+            result=fgoKernel.verifyAdb()
+            if'skip'in result:return logger.warning(f'Verify adb: skipped, {result["skip"]}')
+            return logger.warning(f'Verify adb: {len(result["failure"])} failures{"".join(f" {i}"for i in result["failure"])}, {result["session"]} sessions opened, 8 concurrent sleeps of 300ms in {result["concurrent"]:.2f}ms')
+        if arg.servant:
+            with tempfile.TemporaryDirectory()as temp:result=fgoKernel.verifyServantIndex(arg.file or fgoKernel.synthesizeServantIndex(temp))
+            return logger.warning(f'Verify servant index: {len(result["mismatch"])} mismatches in {result["query"]} slots, {result["full"]:.2f}ms -> {result["index"]:.2f}ms')
+        if arg.detect:
+            assert arg.file or fgoDevice.device.available
+            result=fgoKernel.benchDetect(max(3,arg.number),arg.file)
+            for i,(fast,masked)in result['api'].items():logger.info(f'{i:32}{fast:8.3f}ms{masked:8.3f}ms{masked/fast:7.2f}x')
+            logger.info(f'Prefilter rejected {result["prefilter"]["reject"]} of {sum(result["prefilter"].values())} unmasked compares')
+            return logger.warning(f'Benchmark: detect {result["fast"]:.2f}ms, {result["masked"]/result["fast"]:.2f}x faster than masked')
         assert fgoDevice.device.available
         if not(arg.input or arg.output):arg.input=arg.output=True
-        logger.warning(f'Benchmark: {(lambda x:", ".join(f"{i} {x[i]:.2f}ms"for i,j in(("touch",arg.input),("screenshot",arg.output))if j))(fgoKernel.bench(max(3,arg.number),arg.input,arg.output))}')
+        result=fgoKernel.bench(max(3,arg.number),arg.input,arg.output)
+        if arg.output:logger.info(f'Screenshot {result["screenshot"]:.2f}ms, {result["screenshot"]+result["foreground"]:.2f}ms with a foreground check per frame')
+        logger.warning(f'Benchmark: {", ".join(f"{i} {result[i]:.2f}ms"for i,j in(("touch",arg.input),("screenshot",arg.output))if j)}')
     def do_call(self,line):
         'Call a Additional feature'
         arg=parser_call.parse_args(line.split())
@@ -95,7 +114,7 @@ Some commands support <command> [<subcommand> ...] {{-h, --help}} for further in
         if arg.list:return print(f'last connect: {self.config.device if self.config.device else None}',*fgoDevice.Device.enumDevices(),sep='\n')
         self.config.device=arg.name if arg.name else self.config.device
         countdown(reduce(lambda x,y:x*60+int(y),arg.sleep.replace('.',':').split(':'),0))
-        fgoDevice.device=fgoDevice.Device(self.config.device)
+        fgoDevice.connect(self.config.device,arg.prefetch)
     def complete_connect(self,text,line,begidx,endidx):
         return self.completecommands({
             '':['wsa','win']+[f'/{i}'for i in fgoDevice.helpers]+fgoDevice.Device.enumDevices(),
@@ -123,6 +142,8 @@ Some commands support <command> [<subcommand> ...] {{-h, --help}} for further in
             if platform.system()=='Windows':signal.signal(signal.SIGBREAK,signal.SIG_DFL)
             fgoKernel.fuse.reset()
             fgoKernel.schedule.reset()
+            if XDetectBase.frameCount:logger.info(f'Duplicate frames: {", ".join(f"{k} {j}/{i}"for k,(i,j)in XDetectBase.frameCount.items())}')
+            XDetectBase.frameCount.clear()
         match result:
             case{'type':'Battle'}:
                 logger.warning(f'Battle finished in {color(0xC5E0B4)}{result["time"]//3600:.0f}:{result["time"]//60%60:02.0f}:{result["time"]%60:02.0f}{color()}')
@@ -266,6 +287,11 @@ parser_bench=ArgParser(prog='bench',description=Cmd.do_bench.__doc__)
 parser_bench.add_argument('-n','--number',help='Number of runs (default: %(default)s)',type=validator(int,lambda x:x>=3,'not-less-than-3 int'),default=20)
 parser_bench.add_argument('-i','--input',help='Bench touch, if neither -i nor -o specified, bench them both',action='store_true')
 parser_bench.add_argument('-o','--output',help='Bench screenshot, if neither -i nor -o specified, bench them both',action='store_true')
+parser_bench.add_argument('-d','--detect',help='Bench the is* detect APIs with and without opaque masks',action='store_true')
+parser_bench.add_argument('-p','--pyramid',help='Verify coarse-to-fine search against full search on FILE, or on synthetic screenshots',action='store_true')
+parser_bench.add_argument('-s','--servant',help='Verify servant recognition index against full matching on FILE, or on synthetic screenshots',action='store_true')
+parser_bench.add_argument('-a','--adb',help='Verify pooled adb shell sessions against a stand-in adb server',action='store_true')
+parser_bench.add_argument('-f','--file',help='Screenshot, or directory of screenshots for -p and -s, to bench detect on (default to the current screen, or synthetic screenshots for -p and -s)')
 
 parser_call=ArgParser(prog='call',description=Cmd.do_call.__doc__)
 parser_call.add_argument('func',help='Additional feature name',choices=['fpSummon','lottery','mail','synthesis','dailyFpSummon','summonHistory'])
@@ -273,8 +299,9 @@ parser_call.add_argument('-s','--sleep',help='Sleep before run (default: %(defau
 
 parser_connect=ArgParser(prog='connect',description=Cmd.do_connect.__doc__)
 parser_connect.add_argument('-l','--list',help='List all available devices',action='store_true')
+parser_connect.add_argument('-p','--prefetch',help='Capture the next screenshot while the current one is being detected',action='store_true')
 parser_connect.add_argument('-s','--sleep',help='Sleep before run (default: %(default)s)',type=validator(str,lambda x:re.match(r'\d+([:.]\d+)*$',x),'timedelta'),default='0')
-parser_connect.add_argument('name',help='Device name (default to the last connected one)',default='',nargs='?')
+parser_connect.add_argument('name',help='Device name (default to the last connected one), prefix stream: to capture through a continuous stream',default='',nargs='?')
 
 parser_lock=ArgParser(prog='lock',description=Cmd.do_lock.__doc__)
 parser_lock.add_argument('-u','--unlock',help='Unlock (lock if not specified)',action='store_true')
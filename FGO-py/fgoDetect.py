@@ -1,22 +1,70 @@
-import os,time,cv2,numpy,re,tqdm
+import inspect,itertools,os,sys,threading,time,zlib,cv2,numpy,re
+from enum import IntEnum
 from functools import reduce,wraps
+from fgoAsset import asset,parallel,pyramid,splitAlpha
 from fgoConst import PACKAGE_TO_REGION
 from fgoFuse import fuse
+from fgoMatch import Identity,bound,locPyramid,score,select
 from fgoLogging import getLogger,logMeta
-from fgoMetadata import servantData,servantImg,classImg,materialImg,chapterImg,mapImg,questImg
-from fgoOcr import Ocr
+from fgoMetadata import servantImg,servantIndex,classImg,materialImg,materialIndex,chapterImg,mapImg,questImg
+from fgoOcr import OcrPool
 from fgoSchedule import schedule
 logger=getLogger('Detect')
 
-IMG=type('IMG',(),{i[:-4].upper():(lambda x:(x[...,:3],x[...,3]if x.shape[2]>3 else numpy.ones((x.shape[0],x.shape[1]),dtype=numpy.uint8)*255))(cv2.imread(f'fgoImage/{i}',cv2.IMREAD_UNCHANGED))for i in os.listdir('fgoImage')if i.endswith('.png')})
-for i in range(3):setattr(IMG,f'CHARGE{i}_SMALL',[cv2.resize(i,(0,0),fx=.77,fy=.77,interpolation=cv2.INTER_CUBIC)for i in getattr(IMG,f'CHARGE{i}')])
-IMG.LISTBARINV=[i[::-1]for i in IMG.LISTBAR]
-IMG_CN=type('IMG_CN',(IMG,),{i[:-4].upper():(lambda x:(x[...,:3],x[...,3]if x.shape[2]>3 else numpy.ones((x.shape[0],x.shape[1]),dtype=numpy.uint8)*255))(cv2.imread(f'fgoImage/cn/{i}',cv2.IMREAD_UNCHANGED))for i in os.listdir('fgoImage/cn')if i.endswith('.png')})
-IMG_JP=type('IMG_JP',(IMG,),{i[:-4].upper():(lambda x:(x[...,:3],x[...,3]if x.shape[2]>3 else numpy.ones((x.shape[0],x.shape[1]),dtype=numpy.uint8)*255))(cv2.imread(f'fgoImage/jp/{i}',cv2.IMREAD_UNCHANGED))for i in os.listdir('fgoImage/jp')if i.endswith('.png')})
-IMG_NA=type('IMG_NA',(IMG,),{i[:-4].upper():(lambda x:(x[...,:3],x[...,3]if x.shape[2]>3 else numpy.ones((x.shape[0],x.shape[1]),dtype=numpy.uint8)*255))(cv2.imread(f'fgoImage/na/{i}',cv2.IMREAD_UNCHANGED))for i in os.listdir('fgoImage/na')if i.endswith('.png')})
-IMG_TW=type('IMG_TW',(IMG,),{i[:-4].upper():(lambda x:(x[...,:3],x[...,3]if x.shape[2]>3 else numpy.ones((x.shape[0],x.shape[1]),dtype=numpy.uint8)*255))(cv2.imread(f'fgoImage/tw/{i}',cv2.IMREAD_UNCHANGED))for i in os.listdir('fgoImage/tw')if i.endswith('.png')})
-CLASS={100:classImg[1]}|{scale:[[cv2.resize(j,(0,0),fx=scale/100,fy=scale/100,interpolation=cv2.INTER_CUBIC)for j in i]for i in classImg[1]]for scale in(75,93,125)}
-OCR=type('OCR',(),{i:Ocr(i)for i in tqdm.tqdm(['EN','ZHS','JA','ZHT'],leave=False)})
+splitCache=Identity()
+def splitTemplate(x):return splitCache((x,),lambda:splitAlpha(x)) # keyed by the deduplicated source, so templates shared between regions are the very same objects
+def readTemplate(file):return splitTemplate(asset.imread(file,cv2.IMREAD_UNCHANGED))
+class Template(type):
+    # Every png under _path becomes an upper-cased attribute, decoded on first access and cached on the class that owns the file
+    # _scale declares rescaled variants as {attribute:(source attribute,scale)}, served from the persistent pyramid
+    def __new__(cls,name,bases,attrs):return super().__new__(cls,name,bases,attrs|{'_file':{i[:-4].upper():f'{attrs["_path"]}/{i}'for i in os.listdir(attrs['_path'])if i.endswith('.png')}})
+    def __getattr__(cls,name):
+        if name in cls.__dict__['_file']:value=readTemplate(cls._file[name])
+        elif name in cls.__dict__.get('_scale',{}):value=cls.scaled(*cls._scale[name])
+        elif name in cls.__dict__.get('_derive',{}):value=cls._derive[name](cls)
+        else:
+            for i in cls.__bases__:
+                if isinstance(i,Template):
+                    try:return getattr(i,name)
+                    except AttributeError:pass
+            raise AttributeError(f'type object {cls.__name__!r} has no attribute {name!r}')
+        setattr(cls,name,value)
+        return value
+    def __iter__(cls):return iter(sorted({j for i in cls.__mro__ if isinstance(i,Template)for j in(*i._file,*i.__dict__.get('_scale',()),*i.__dict__.get('_derive',()))}))
+    def preload(cls):
+        for i in cls.__mro__:
+            if isinstance(i,Template)and(scale:=[j for j in i.__dict__.get('_scale',())if j not in i.__dict__]):
+                for j,k in zip(scale,pyramid.resize([(i.file(i._scale[j][0]),i._scale[j][1])for j in scale])):setattr(i,j,splitTemplate(k)) # one batch, so a cold pyramid is written once
+        parallel(lambda i:getattr(cls,i),list(cls))
+        return cls
+    def file(cls,name):
+        if(file:=next((i._file[name]for i in cls.__mro__ if isinstance(i,Template)and name in i._file),None))is None:raise AttributeError(f'type object {cls.__name__!r} has no template file {name!r}')
+        return file
+    def scaled(cls,name,scale):return splitTemplate(pyramid[cls.file(name),scale])
+class IMG(metaclass=Template):
+    _path='fgoImage'
+    _scale={f'CHARGE{i}_SMALL':(f'CHARGE{i}',.77)for i in range(3)}
+    _derive={'LISTBARINV':lambda cls:[i[::-1]for i in cls.LISTBAR]}
+class IMG_CN(IMG):_path='fgoImage/cn'
+class IMG_JP(IMG):_path='fgoImage/jp'
+class IMG_NA(IMG):_path='fgoImage/na'
+class IMG_TW(IMG):_path='fgoImage/tw'
+CLASS={100:classImg[1]}|(lambda file,scale:(lambda img:{j:[splitTemplate(k)for k in img[i*len(file):(i+1)*len(file)]]for i,j in enumerate(scale)})(pyramid.resize([(i,j/100)for j in scale for i in file])))([f'fgoImage/class/{i}'for i in asset.listdir('fgoImage/class')],(75,93,125))
+OCR=OcrPool('EN','ZHS','JA','ZHT')
+class Screen(IntEnum): # in priority order, the first matching screen wins
+    UNKNOWN=0
+    STORY_SKIP_CONFIRM=1
+    STORY_SKIP_BUTTON=2
+    STORY_PLAYING=3
+    MAIN_INTERFACE=4
+    BATTLE_CONTINUE=5
+    SKILL_CAST_FAILED=6
+    TURN_BEGIN=7
+    ADD_FRIEND=8
+    SPECIAL_DROP_SUSPENDED=9
+    SPECIAL_DROP_RAINBOW_BOX=10
+    BATTLE_FINISHED=11
+    BATTLE_DEFEATED=12
 def coroutine(func):
     @wraps(func)
     def primer(*args,**kwargs):
@@ -35,9 +83,30 @@ def validate(validator=lambda x:x):
 class XDetectBase(metaclass=logMeta(logger)):
     # The accuracy of each API here is designed to be 100% at 1280x720 resolution, if you find any mismatches, please submit an issue, with a screenshot saved via Detect.cache.save() or fuse.save().
     screenshot=None
+    prefetch=None
     enemyGird=0
+    memoCount=[0,0]
+    prefilterReject=0
+    prefilterPass=0
+    screenCount={}
+    frameCount={}
+    lastFrame=None,None
+    screenTable={ # template, rect and threshold of each screen, shared by classifyScreen and the is* API
+        Screen.STORY_SKIP_CONFIRM:('STORYSKIPCONFIRM',(550,480,1000,620),.05),
+        Screen.STORY_SKIP_BUTTON:('STORYSKIPBUTTON',(1100,0,1280,100),.05),
+        Screen.STORY_PLAYING:('STORYMENU',(1000,400,1280,620),.25),
+        Screen.MAIN_INTERFACE:('MENU',(1104,613,1267,676),.05),
+        Screen.BATTLE_CONTINUE:('BATTLECONTINUE',(704,530,976,618),.05),
+        Screen.SKILL_CAST_FAILED:('SKILLERROR',(504,528,776,597),.05),
+        Screen.TURN_BEGIN:('ATTACK',(1155,635,1210,682),.05),
+        Screen.ADD_FRIEND:('ADDFRIEND',(161,574,499,656),.05),
+        Screen.SPECIAL_DROP_SUSPENDED:('CLOSE',(6,14,28,68),.05),
+        Screen.SPECIAL_DROP_RAINBOW_BOX:('RAINBOW',(957,2,990,40),.1),
+        Screen.BATTLE_FINISHED:('DROPITEM',(110,30,264,76),.05),
+        Screen.BATTLE_DEFEATED:('DEFEATED',(603,100,690,176),.05),
+    }
     tmpl=IMG
-    ocr=OCR.EN
+    ocr=OCR.lazy('EN')
     def retryOnError(err=(TypeError,ValueError,IndexError,AssertionError)):
         def wrapper(func):
             @wraps(func)
@@ -49,26 +118,63 @@ class XDetectBase(metaclass=logMeta(logger)):
             return wrap
         return wrapper
     def __init__(self):
-        self.im=self.screenshot()
-        self.time=time.time()
-    def _crop(self,rect):return self.im[rect[1]:rect[3],rect[0]:rect[2]]
-    def _loc(self,img,rect=(0,0,1280,720)):return cv2.minMaxLoc(cv2.matchTemplate(self._crop(rect),img[0],cv2.TM_SQDIFF_NORMED,mask=img[1]))
-    def _compare(self,img,rect=(0,0,1280,720),threshold=.05):return threshold>self._loc(img,rect)[0]
-    def _select(self,img,rect=(0,0,1280,720),threshold=.2):return(lambda x:numpy.argmin(x)if threshold>min(x)else None)([self._loc(i,rect)[0]for i in img])
-    def _find(self,img,rect=(0,0,1280,720),threshold=.05):return(lambda loc:(rect[0]+loc[2][0]+(img[0].shape[1]>>1),rect[1]+loc[2][1]+(img[0].shape[0]>>1))if loc[0]<threshold else None)(self._loc(img,rect))
-    def _ocrInt(self,rect):return OCR.EN.ocrInt(self._crop(rect))
+        self.frame=self.screenshot()
+        self.time=getattr(self.frame,'stamp',None)or time.time()
+        self.memo=self._dedup()
+    @property
+    def im(self):return getattr(self.frame,'image',self.frame) # a lazily converted frame, as fgoAndroid captures, is resampled in full only here
+    @im.setter
+    def im(self,img):self.frame=img
+    def _dedup(self):
+        # A frame identical to the previous one, as polling loops grab while the game has not moved yet, takes over its memo, so nothing is matched twice
+        # Frames are counted per phase, the function outside this module that asked for the screenshot
+        digest=(raw:=getattr(self.frame,'raw',self.frame)).shape,zlib.crc32(numpy.ascontiguousarray(raw))
+        frame=sys._getframe(1)
+        while frame and frame.f_code.co_filename==__file__:frame=frame.f_back
+        count=XDetectBase.frameCount.setdefault(getattr(frame.f_code,'co_qualname',frame.f_code.co_name)if frame else'',[0,0])
+        count[0]+=1
+        if digest==XDetectBase.lastFrame[0]:
+            count[1]+=1
+            return XDetectBase.lastFrame[1]
+        XDetectBase.lastFrame=digest,(memo:=Identity(stat=XDetectBase.memoCount))
+        return memo
+    def _memo(self,key,obj,func):return self.memo(obj,func,*key) # results depend on nothing but the frame, so each is computed once per frame
+    @staticmethod
+    def memoStat():return dict(zip(('hit','miss'),XDetectBase.memoCount))
+    @staticmethod
+    def prefilterStat():return{'reject':XDetectBase.prefilterReject,'pass':XDetectBase.prefilterPass}
+    @staticmethod
+    def frameStat():return{k:{'frame':v[0],'duplicate':v[1]}for k,v in sorted(XDetectBase.frameCount.items(),key=lambda x:-x[1][0])}
+    @staticmethod
+    def screenStat():return{i.name:j for i,j in sorted(XDetectBase.screenCount.items(),key=lambda x:-x[1])}
+    def _crop(self,rect):return self.frame.crop(rect)if hasattr(self.frame,'crop')else self.frame[rect[1]:rect[3],rect[0]:rect[2]]
+    def _loc(self,img,rect=(0,0,1280,720),level=0):return self._memo(('loc',*rect,level),img,lambda:locPyramid(self._crop(rect),img,level)) # level>0 searches coarse to fine from 1/2**level, for large rects
+    def _compare(self,img,rect=(0,0,1280,720),threshold=.05,level=0):return not self._reject(img,rect,threshold,level)and threshold>self._loc(img,rect,level)[0]
+    def _bound(self,img,rect):return self._memo(('bound',*rect),img,lambda:bound(self._crop(rect),img))
+    def _reject(self,img,rect,threshold,level=0):
+        # a lower bound of the score settles most misses without matching, with a slack for float32
+        if Identity.key(img,'loc',*rect,level)in self.memo:return False
+        if reject:=self._bound(img,rect)-1e-4>=threshold:XDetectBase.prefilterReject+=1
+        else:XDetectBase.prefilterPass+=1
+        return reject
+    def _select(self,img,rect=(0,0,1280,720),threshold=.2):return self._selectMany(img,(rect,),threshold)[0]
+    def _selectMany(self,img,rect,threshold=.2):return(lambda img,rect:self._memo(('select',*(j for i in rect for j in i),threshold),[j for i in img for j in i[:2]],lambda:select(img,[self._crop(i)for i in rect],threshold)))(tuple(img),tuple(rect))
+    def _find(self,img,rect=(0,0,1280,720),threshold=.05,level=0):return(lambda loc:(rect[0]+loc[2][0]+(img[0].shape[1]>>1),rect[1]+loc[2][1]+(img[0].shape[0]>>1))if loc[0]<threshold else None)(self._loc(img,rect,level))
+    def _ocrInt(self,rect):return self._memo(('ocrInt',*rect),(),lambda:OCR.EN.ocrInt(self._crop(rect)))
     def _ocrText(self,rect):raise NotImplementedError
-    def _count(self,img,rect=(0,0,1280,720),threshold=.1):return cv2.connectedComponents((cv2.matchTemplate(self._crop(rect),img[0],cv2.TM_SQDIFF_NORMED,mask=img[1])<threshold).astype(numpy.uint8))[0]-1
+    def _count(self,img,rect=(0,0,1280,720),threshold=.1):return self._memo(('count',*rect,threshold),img,lambda:cv2.connectedComponents((cv2.matchTemplate(self._crop(rect),img[0],cv2.TM_SQDIFF_NORMED,mask=img[1])<threshold).astype(numpy.uint8))[0]-1)
     @staticmethod
     def _stack(origin,increment,critic):return numpy.vstack((origin,increment[cv2.minMaxLoc(cv2.matchTemplate(increment,origin[-critic:],cv2.TM_SQDIFF_NORMED))[2][1]+critic:]))
+    def _digest(self,rect,block=8):return self._memo(('digest',*rect,block),(),lambda:cv2.resize(self._crop(rect),(max(1,(rect[2]-rect[0])//block),max(1,(rect[3]-rect[1])//block)),interpolation=cv2.INTER_AREA).astype(numpy.float32)) # mean colour of about block*block cells, 1/block**2 of the rect
     @coroutine
-    def _asyncImageChange(self,rect,threshold=.02):
-        img=self._crop(rect)
+    def _asyncImageChange(self,rect,threshold=.02,block=8):
+        # Only the digest of the previous frame is kept, compared under the formula of cv2.TM_SQDIFF_NORMED, text needs a finer block than pictures to tell a digit change
+        digest=self._digest(rect,block)
         detect=yield None
         while True:
-            tmp=detect._crop(rect)
-            detect=yield threshold<cv2.matchTemplate(img,tmp,cv2.TM_SQDIFF_NORMED)[0][0]
-            img=tmp
+            tmp=detect._digest(rect,block)
+            detect=yield threshold<numpy.square(digest-tmp).sum()/max(numpy.sqrt(numpy.square(digest).sum()*numpy.square(tmp).sum()),1e-6)
+            digest=tmp
     @coroutine
     def _asyncValueChange(self,init):
         a=[init,(yield None)]
@@ -76,11 +182,27 @@ class XDetectBase(metaclass=logMeta(logger)):
         while True:
             a[p]=yield a[0]!=a[1]
             p^=1
+    def _classifyScreen(self,candidate):
+        # Candidates are matched cheapest first, and one ranked below an already matched screen is not matched at all, so the result is that of an if/elif chain in priority order
+        # Returns the screen and a confidence in [0,1], the margin of the match score (or of the closest miss for UNKNOWN, understated by the bound where a candidate was rejected) relative to its threshold
+        tmpl={i:(img,rect,threshold)for i in candidate for name,rect,threshold in(self.screenTable[i],)if(img:=getattr(self.tmpl,name,None))is not None}
+        cost=lambda x:(x[1][2]-x[1][0]-x[0][0].shape[1]+1)*(x[1][3]-x[1][1]-x[0][0].shape[0]+1)*x[0][0].size
+        best=(Screen.UNKNOWN,0.)
+        score=[]
+        for state,(img,rect,threshold)in sorted(tmpl.items(),key=lambda x:cost(x[1])):
+            if best[0]and state>best[0]:continue
+            score.append(loc:=(self._bound(img,rect)if self._reject(img,rect,threshold)else self._loc(img,rect)[0])/threshold)
+            if loc<1:best=(state,1-loc)
+        if not best[0]and score:best=(Screen.UNKNOWN,min(1.,min(score)-1))
+        XDetectBase.screenCount[best[0]]=XDetectBase.screenCount.get(best[0],0)+1
+        return best
+    def _isScreen(self,screen):return(lambda name,rect,threshold:(img:=getattr(self.tmpl,name,None))is not None and self._compare(img,rect,threshold))(*self.screenTable[screen])
     def _isListBegin(self,pos):return(lambda x:x[0]>.1 or pos[1]>x[2][1]-5)(self._loc(self.tmpl.LISTBARINV,(pos[0]-19,0,pos[0]+19,720)))
     def _isListEnd(self,pos):return(lambda x:x[0]>.1 or pos[1]<x[2][1]+30)(self._loc(self.tmpl.LISTBAR,(pos[0]-19,0,pos[0]+19,720)))
     def inject(self,img):
         self.im=img
         self.time=time.time()
+        self.memo=Identity(stat=XDetectBase.memoCount)
         return self
     def save(self,name='Screenshot',rect=(0,0,1280,720),appendTime=True):return cv2.imwrite(name:=time.strftime(f'{name}{f"_%Y-%m-%d_%H.%M.%S.{round(self.time*1000)%1000:03}"if appendTime else""}.png',time.localtime(self.time)),self._crop(rect),[cv2.IMWRITE_PNG_COMPRESSION,9])and name
     def show(self):
@@ -88,20 +210,21 @@ class XDetectBase(metaclass=logMeta(logger)):
         if cv2.waitKey()==ord('s'):self.save()
         cv2.destroyAllWindows()
     def setupEnemyGird(self):
-        XDetectBase.enemyGird=2 if any(self._select(CLASS[75],(110+200*i,1,173+200*i,48))is not None for i in range(3))else 1 if False else 0
+        XDetectBase.enemyGird=2 if any(i is not None for i in self._selectMany(CLASS[75],[(110+200*i,1,173+200*i,48)for i in range(3)]))else 1 if False else 0
         return XDetectBase.enemyGird
-    def setupLottery(self):XDetectBase._watchLottery=self._asyncImageChange((983,4,1037,34))
-    def setupMailDone(self):XDetectBase._watchMailDone=self._asyncImageChange((202,104,252,124))
+    def setupLottery(self):XDetectBase._watchLottery=self._asyncImageChange((983,4,1037,34),block=2)
+    def setupMailDone(self):XDetectBase._watchMailDone=self._asyncImageChange((202,104,252,124),block=2)
     def setupServantDead(self,friend=None):
         XDetectBase._watchServantPortrait=[self._asyncImageChange((130+318*i,426,197+318*i,494))for i in range(3)]
         XDetectBase._watchServantFriend=[self._asyncValueChange(self.isServantFriend(i)if friend is None else friend[i])for i in range(3)]
     def setupSummonHistory(self):XDetectBase._summonHistory=cv2.threshold(cv2.cvtColor(self._crop((147,157,1105,547)),cv2.COLOR_BGR2GRAY),128,255,cv2.THRESH_BINARY)[1]
     def setupWeeklyMission(self):XDetectBase._weeklyMission=self._crop((603,250,1092,710))
-    def isAddFriend(self):return self._compare(self.tmpl.ADDFRIEND,(161,574,499,656))
+    def classifyScreen(self,candidate=tuple(Screen)[1:]):return self._memo(('screen',*candidate),(),lambda:self._classifyScreen(candidate))
+    def isAddFriend(self):return self._isScreen(Screen.ADD_FRIEND)
     def isApEmpty(self):return self._compare(self.tmpl.APEMPTY,(522,582,758,652))
-    def isBattleContinue(self):return self._compare(self.tmpl.BATTLECONTINUE,(704,530,976,618))
-    def isBattleDefeated(self):return self._compare(self.tmpl.DEFEATED,(603,100,690,176))
-    def isBattleFinished(self):return self._compare(self.tmpl.DROPITEM,(110,30,264,76))
+    def isBattleContinue(self):return self._isScreen(Screen.BATTLE_CONTINUE)
+    def isBattleDefeated(self):return self._isScreen(Screen.BATTLE_DEFEATED)
+    def isBattleFinished(self):return self._isScreen(Screen.BATTLE_FINISHED)
     def isBattleFormation(self):return self._compare(self.tmpl.BATTLEBEGIN,(1070,632,1270,710))
     def isChooseFriend(self):return any(self._compare(i,(1189,190,1210,243))for i in(self.tmpl.CHOOSEFRIEND,self.tmpl.CHOOSEFRIENDEX))
     def isCardSealed(self):return[self._compare(self.tmpl.CHARASEALED,(76+257*i,479,225+257*i,533),.3)or any(self._compare(j,(44+257*i,492,68+257*i,528),.14)for j in(self.tmpl.CARDSEALEDARTS,self.tmpl.CARDSEALEDQUICK,self.tmpl.CARDSEALEDBUSTER))for i in range(5)]
@@ -111,47 +234,41 @@ class XDetectBase(metaclass=logMeta(logger)):
     def isHouguReady(self,that=None):return(lambda that:[not any(that._compare(j,(313+231*i,172,515+231*i,258),.52)for j in(self.tmpl.HOUGUSEALED,self.tmpl.CHARASEALED))and(numpy.mean(self._crop((144+319*i,679,156+319*i,684)))>55 or numpy.mean(that._crop((144+319*i,679,156+319*i,684)))>55)for i in range(3)])((time.sleep(.15),type(self)())[1]if that is None else that)
     def isLotteryContinue(self):return self._watchLottery.send(self)
     def isMailDone(self):return self._watchMailDone.send(self)
-    def isMainInterface(self):return self._compare(self.tmpl.MENU,(1104,613,1267,676))
+    def isMainInterface(self):return self._isScreen(Screen.MAIN_INTERFACE)
     def isMailListEnd(self):return self._isListEnd((937,679))
     def isNetworkError(self):return self._compare(self.tmpl.NETWORKERROR,(703,529,974,597))
     def isNoFriend(self):return self._compare(self.tmpl.NOFRIEND,(245,362,274,392))
-    def isQuestFreeContains(self,chapter):return self._compare((questImg[chapter],None),(1075,115,1111,575))
+    def isQuestFreeContains(self,chapter):return self._compare((questImg[chapter],None),(1075,115,1111,575),level=1)
     def isQuestFreeFirst(self,chapter):return self._compare((questImg[chapter],None),(1075,115,1111,270))
     def isQuestListBegin(self):return self._isListBegin((1258,95))
     def isServantDead(self,pos,friend=None):return any((self._watchServantPortrait[pos].send(self),self._watchServantFriend[pos].send(self.isServantFriend(pos)if friend is None else friend)))
     def isServantFriend(self,pos):return self._compare(self.tmpl.SUPPORT,(187+318*pos,394,225+318*pos,412))
-    def isSkillCastFailed(self):return self._compare(self.tmpl.SKILLERROR,(504,528,776,597))
+    def isSkillCastFailed(self):return self._isScreen(Screen.SKILL_CAST_FAILED)
     def isSkillNone(self):return self._compare(self.tmpl.CROSS,(1070,45,1105,79))or self._compare(self.tmpl.CROSS,(1093,164,1126,196))
     def isSkillReady(self,i,j):return not self._compare(self.tmpl.STILL,(35+318*i+88*j,598,55+318*i+88*j,618),.2)
-    def isSpecialDropRainbowBox(self):return self._compare(self.tmpl.RAINBOW,(957,2,990,40),.1)
-    def isSpecialDropSuspended(self):return self._compare(self.tmpl.CLOSE,(6,14,28,68))
+    def isSpecialDropRainbowBox(self):return self._isScreen(Screen.SPECIAL_DROP_RAINBOW_BOX)
+    def isSpecialDropSuspended(self):return self._isScreen(Screen.SPECIAL_DROP_SUSPENDED)
     def isSummonHistoryListEnd(self):return self._isListEnd((1142,552))
     def isSynthesisBegin(self):return self._compare(self.tmpl.SYNTHESIS,(16,12,112,73))
     def isSynthesisFinished(self):return self._compare(self.tmpl.DECIDEDISABLED,(1035,625,1275,711))
     def isTerminal(self):return numpy.mean(self._crop((111,571,162,610)))<100
-    def isTurnBegin(self):return self._compare(self.tmpl.ATTACK,(1155,635,1210,682))
+    def isTurnBegin(self):return self._isScreen(Screen.TURN_BEGIN)
     def isWeeklyMission(self):return numpy.min(cv2.matchTemplate(servantImg[1][1][3][0],cv2.resize(self._crop((296,117,421,210)),(0,0),fx=.555,fy=.555,interpolation=cv2.INTER_CUBIC),cv2.TM_SQDIFF_NORMED))<.1
     def isWeeklyMissionListEnd(self):return self._isListEnd((1261,614))
     def isStoryPlaying(self):
         """检测是否处于剧情播放界面 - 检测右下角菜单按钮"""
-        if not hasattr(self.tmpl,'STORYMENU'):
-            return False
         # 扩大搜索区域，放宽阈值到0.25
-        return self._compare(self.tmpl.STORYMENU,(1000,400,1280,620),threshold=0.25)
+        return self._isScreen(Screen.STORY_PLAYING)
     def isStorySkipButton(self):
         """检测是否出现跳过按钮 - 右上角 (1189,44)"""
-        if not hasattr(self.tmpl,'STORYSKIPBUTTON'):
-            return False
-        return self._compare(self.tmpl.STORYSKIPBUTTON,(1100,0,1280,100))
+        return self._isScreen(Screen.STORY_SKIP_BUTTON)
     def isStorySkipConfirm(self):
         """检测是否出现跳过剧情确认弹窗的"是"按钮 (825,557)"""
-        if not hasattr(self.tmpl,'STORYSKIPCONFIRM'):
-            return False
         # 模板269x71，区域需要足够大
-        return self._compare(self.tmpl.STORYSKIPCONFIRM,(550,480,1000,620))
+        return self._isScreen(Screen.STORY_SKIP_CONFIRM)
     @retryOnError()
-    def getCardColor(self):return[+self._select((self.tmpl.ARTS,self.tmpl.QUICK,self.tmpl.BUSTER),(80+257*i,537,131+257*i,581))for i in range(5)]
-    def getCardCriticalRate(self):return[(lambda x:0 if x is None else x+1)(self._select((self.tmpl.CRITICAL1,self.tmpl.CRITICAL2,self.tmpl.CRITICAL3,self.tmpl.CRITICAL4,self.tmpl.CRITICAL5,self.tmpl.CRITICAL6,self.tmpl.CRITICAL7,self.tmpl.CRITICAL8,self.tmpl.CRITICAL9,self.tmpl.CRITICAL0),(76+257*i,350,113+257*i,405),.06))for i in range(5)]
+    def getCardColor(self):return[+i for i in self._selectMany((self.tmpl.ARTS,self.tmpl.QUICK,self.tmpl.BUSTER),[(80+257*i,537,131+257*i,581)for i in range(5)])]
+    def getCardCriticalRate(self):return[0 if i is None else i+1 for i in self._selectMany((self.tmpl.CRITICAL1,self.tmpl.CRITICAL2,self.tmpl.CRITICAL3,self.tmpl.CRITICAL4,self.tmpl.CRITICAL5,self.tmpl.CRITICAL6,self.tmpl.CRITICAL7,self.tmpl.CRITICAL8,self.tmpl.CRITICAL9,self.tmpl.CRITICAL0),[(76+257*i,350,113+257*i,405)for i in range(5)],.06)]
     def getCardGroup(self):
         universe={0,1,2,3,4}
         result=[-1]*5
@@ -162,19 +279,20 @@ class XDetectBase(metaclass=logMeta(logger)):
             index+=1
             universe-=group
         return result
-    def getCardResist(self):return[{0:1,1:2}.get(self._select((self.tmpl.WEAK,self.tmpl.RESIST),(180+257*i,318,226+257*i,417)if i<5 else(-695+232*i,54,-649+232*i,117)),0)for i in range(8)]
-    def getCardServant(self,hint):return(lambda target:[(lambda img:min((numpy.min(cv2.matchTemplate(img,i[0],cv2.TM_SQDIFF_NORMED,mask=i[1])),no)for no,card in target for i in card)[1])(self._crop((76+257*i,431,184+257*i,498)))for i in range(5)])([(i,servantImg[i][0])for i in hint])
+    def getCardResist(self):return[{0:1,1:2}.get(i,0)for i in self._selectMany((self.tmpl.WEAK,self.tmpl.RESIST),[(180+257*i,318,226+257*i,417)if i<5 else(-695+232*i,54,-649+232*i,117)for i in range(8)])]
+    def getCardServant(self,hint):return[hint[i]for i in self.getCardServantScore(hint).argmin(1)]
+    def getCardServantScore(self,hint):return self._memo(('cardServant',*hint),(),lambda:(lambda card:numpy.minimum.reduceat(score([j for i in card for j in i],[self._crop((76+257*i,431,184+257*i,498))for i in range(5)]),numpy.cumsum([0]+[len(i)for i in card[:-1]]),1))([servantImg[i][0]for i in hint])) # 5 cards by len(hint) servants, the best score among the card strips of each
     def getEnemyHp(self,pos):
         if self.enemyGird==0:return 0 if pos>2 else self._ocrInt((100+250*pos,40,222+250*pos,65))
         if self.enemyGird==2:return self._ocrInt((190+pos%3*200-pos//3*100,28+pos//3*99,287+pos%3*200-pos//3*100,53+pos//3*99))
     def getEnemyNp(self,pos):
         if self.enemyGird==0:return(0,0)if pos>2 else(lambda count:(lambda c2:(c2,c2)if c2 else(lambda c0,c1:(c1,c0+c1))(count(self.tmpl.CHARGE0),count(self.tmpl.CHARGE1),))(count(self.tmpl.CHARGE2)))(lambda img:self._count(img,(160+250*pos,67,250+250*pos,88)))
         if self.enemyGird==2:return(lambda count:(lambda c2:(c2,c2)if c2 else(lambda c0,c1:(c1,c0+c1))(count(self.tmpl.CHARGE0_SMALL),count(self.tmpl.CHARGE1_SMALL),))(count(self.tmpl.CHARGE2_SMALL)))(lambda img:self._count(img,(231+pos%3*200-pos//3*100,49+pos//3*99,311+pos%3*200-pos//3*100,72+pos//3*99)))
-    def getFieldServant(self,pos):return(lambda img,cls:min((numpy.min(cv2.matchTemplate(img,i[0],cv2.TM_SQDIFF_NORMED,mask=i[1])),no)for no,(_,portrait,_)in servantImg.items()if servantData[no][0]==cls[0]for i in portrait)[1]if cls else 0)(self._crop((120+318*pos,421,207+318*pos,490)),self.getFieldServantClassRank(pos))
+    def getFieldServant(self,pos):return(lambda cls:servantIndex[cls[0]](self._crop((120+318*pos,421,207+318*pos,490)))[1]if cls else 0)(self.getFieldServantClassRank(pos))
     def getFieldServantClassRank(self,pos):return(lambda x:x if x is None else classImg[0][x])(self._select(CLASS[125],(13+318*pos,618,117+318*pos,702)))
     def getFieldServantHp(self,pos):return self._ocrInt((200+317*pos,620,293+317*pos,644))
     def getFieldServantNp(self,pos):return self._ocrInt((220+317*pos,655,271+317*pos,680))
-    def getMaterial(self):return(lambda x:{materialImg[i][0]:x.count(i)for i in set(x)-{None}})([self._select(((i[1],None)for i in materialImg),(176+i%7*137,110+i//7*142,253+i%7*137,187+i//7*142),.02)for i in range(1,21)])
+    def getMaterial(self):return(lambda x:{materialImg[i][0]:x.count(i)for i in set(x)-{None}})(materialIndex.select(list(itertools.takewhile(lambda x:x.std()>8,(self._crop((176+i%7*137,110+i//7*142,253+i%7*137,187+i//7*142))for i in range(1,21)))),.02)) # drops fill the grid in order, so the scan ends at the first flat, empty slot
     def getSkillTargetCount(self):return(lambda x:numpy.bincount(numpy.diff(x))[1]+x[0])(cv2.dilate(numpy.max(cv2.threshold(numpy.max(self._crop((306,320,973,547)),axis=2),67,1,cv2.THRESH_BINARY)[1],axis=0).reshape(1,-1),numpy.ones((1,66),numpy.uint8)).ravel())if self._compare(self.tmpl.CROSS,(980,0,1280,300))else 0
     @retryOnError()
     @validate()
@@ -187,12 +305,12 @@ class XDetectBase(metaclass=logMeta(logger)):
     def getSummonHistoryCount(cls):return cls.__new__(cls).inject(XDetectBase._summonHistory)._count((cls.tmpl.SUMMONHISTORY[0][...,0],cls.tmpl.SUMMONHISTORY[1]),(28,0,60,XDetectBase._summonHistory.shape[0]),.7)
     def getTeamIndex(self):return self._loc(self.tmpl.TEAMINDEX,(452,34,828,62))[2][0]//25
     # getTeam* series except getTeamIndex APIs are not used now
-    def getTeamServantCard(self):return[reduce(lambda x,y:x<<1|y,(numpy.argmax(self.im[526,150+200*i+15*(i>2)+21*j])==0 for j in range(3)))for i in range(6)]
-    def getTeamServantClassRank(self):return[(lambda x:x if x is None else classImg[0][x])(self._select(CLASS[100],(30+200*i+15*(i>2),133,115+200*i+15*(i>2),203)))for i in range(6)]
+    def getTeamServantCard(self):return(lambda row:[reduce(lambda x,y:x<<1|y,(numpy.argmax(row[150+200*i+15*(i>2)+21*j])==0 for j in range(3)))for i in range(6)])(self._crop((0,526,1280,527))[0])
+    def getTeamServantClassRank(self):return[i if i is None else classImg[0][i]for i in self._selectMany(CLASS[100],[(30+200*i+15*(i>2),133,115+200*i+15*(i>2),203)for i in range(6)])]
     def getWeeklyMission(self):XDetectBase._weeklyMission=self._stack(XDetectBase._weeklyMission,self._crop((603,250,1092,710)),157)
-    def findChapter(self,chapter):return self._find((chapterImg[chapter],None),(640,90,1230,600))
-    def findFriend(self,img):return self._find(img,(13,166,1233,720),.04)
-    def findMail(self,img):return self._find(img,(73,166,920,720),.017)
+    def findChapter(self,chapter):return self._find((chapterImg[chapter],None),(640,90,1230,600),level=1)
+    def findFriend(self,img):return self._find(img,(13,166,1233,720),.04,1)
+    def findMail(self,img):return self._find(img,(73,166,920,720),.017,1)
     def findMapCamera(self,chapter):return numpy.array(cv2.minMaxLoc(cv2.matchTemplate(mapImg[chapter],cv2.resize(self._crop((200,200,1080,520)),(0,0),fx=.3,fy=.3,interpolation=cv2.INTER_CUBIC),cv2.TM_SQDIFF_NORMED))[2])/.3+(440,160)
     @classmethod
     def saveSummonHistory(cls):return(lambda c:(lambda img:(c,cls.__new__(cls).inject(img).save(f'SummonHistory({c})',(0,0,*img.shape[::-1]))))(numpy.vstack((cv2.putText(numpy.zeros((36,XDetectBase._summonHistory.shape[1]),numpy.uint8),f'SummonHistory({c}) generated by FGO-py',(8,26),cv2.FONT_HERSHEY_DUPLEX,0.85,255,2,cv2.LINE_4),XDetectBase._summonHistory[:numpy.flatnonzero(numpy.max(XDetectBase._summonHistory,axis=1))[-1]+2]))))(cls.getSummonHistoryCount())
@@ -209,7 +327,7 @@ class XDetectBase(metaclass=logMeta(logger)):
     def getTeamServantSkillLv(self):raise NotImplementedError
 class XDetectCN(XDetectBase):
     tmpl=IMG_CN
-    ocr=OCR.ZHS
+    ocr=OCR.lazy('ZHS')
     @classmethod
     def saveWeeklyMission(cls):
         result=[]
@@ -222,19 +340,20 @@ class XDetectCN(XDetectBase):
         return result
 class XDetectJP(XDetectBase):
     tmpl=IMG_JP
-    ocr=OCR.JA
+    ocr=OCR.lazy('JA')
 class XDetectNA(XDetectBase):
     tmpl=IMG_NA
-    ocr=OCR.EN
+    ocr=OCR.lazy('EN')
     def isHouguReady(self,that=None):return(lambda that:[not any(that._compare(j,(313+231*i,194,515+231*i,270),.52)for j in(self.tmpl.HOUGUSEALED,self.tmpl.CHARASEALED))and(numpy.mean(self._crop((144+319*i,679,156+319*i,684)))>55 or numpy.mean(that._crop((144+319*i,679,156+319*i,684)))>55)for i in range(3)])((time.sleep(.15),type(self)())[1]if that is None else that)
     def isSkillReady(self,i,j):return not self._compare(self.tmpl.STILL,(41+318*i+88*j,607,74+318*i+88*j,614),.6)
 class XDetectTW(XDetectBase):
     tmpl=IMG_TW
-    ocr=OCR.ZHT
+    ocr=OCR.lazy('ZHT')
     def isHouguReady(self,that=None):return(lambda that:[not any(that._compare(j,(313+231*i,194,515+231*i,270),.52)for j in(self.tmpl.HOUGUSEALED,self.tmpl.CHARASEALED))and(numpy.mean(self._crop((144+319*i,679,156+319*i,684)))>55 or numpy.mean(that._crop((144+319*i,679,156+319*i,684)))>55)for i in range(3)])((time.sleep(.15),type(self)())[1]if that is None else that)
 class DetectBase(XDetectBase):
     def __init__(self,anteLatency=.1,postLatency=0):
-        schedule.sleep(anteLatency)
+        if self.prefetch:self.screenshot=lambda:self.prefetch(anteLatency) # the ante latency counts from the last input, and a frame captured meanwhile is taken at once
+        else:schedule.sleep(anteLatency)
         super().__init__()
         fuse.increase()
         schedule.sleep(postLatency)
@@ -242,6 +361,9 @@ class DetectBase(XDetectBase):
     def _find(self,*args,**kwargs):
         if(t:=super()._find(*args,**kwargs))is not None:fuse.reset(self)
         return t
+    def classifyScreen(self,*args,**kwargs):
+        if(t:=super().classifyScreen(*args,**kwargs))[0]:fuse.reset(self)
+        return t
     @coroutine
     def _asyncImageChange(self,*args,**kwargs):
         inner=super()._asyncImageChange(*args,**kwargs)
@@ -262,8 +384,13 @@ class XDetect:
         else:cls.cache=XDetectBase(*args,**kwargs)
         return cls.cache
 class Detect(XDetect):provider={'CN':DetectCN,'JP':DetectJP,'NA':DetectNA,'TW':DetectTW}
-def setup(device):
+def setup(device,prefetch=None):
     XDetectBase.screenshot=device.screenshot
+    XDetectBase.prefetch=prefetch
     if not hasattr(device,'package'):return
     XDetect.region=PACKAGE_TO_REGION.get(device.package,'CN')
     logger.warning(f'Package: {device.package}, Region: {XDetect.region}')
+    if XDetect.region not in XDetect.provider:return
+    XDetect.provider[XDetect.region].tmpl.preload()
+    OCR.unload(*(lang:=('EN',inspect.getattr_static(XDetect.provider[XDetect.region],'ocr').lang)))
+    threading.Thread(target=OCR.preload,args=lang,daemon=True,name='OcrPreload').start()
@@ -1,7 +1,9 @@
-from fgoAndroid import Android
+import os,threading,time
+from fgoAndroid import Android,Frame
 from fgoDetect import setup
 from fgoLogging import getLogger
 from fgoSchedule import schedule
+from fgoStream import Stream,Video
 logger=getLogger('Device')
 
 helpers={}
@@ -28,8 +30,76 @@ def bs5(*args):
     with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE,r'SOFTWARE\BlueStacks_nxt')as key:dir=winreg.QueryValueEx(key,'UserDefinedDir')[0]
     with open(os.path.join(dir,'bluestacks.conf'))as f:return'127.0.0.1:'+re.search(rf'bst\.instance\.{"_".join(args)}\.status\.adb_port="(\d*)"',f.read()).group(1)
 
+class Recording:
+    # A recorded video standing in for the screen of a device, use it as the output of "serial|stream:file" to run detection on a replay
+    def __init__(self,file):
+        self.name=file
+        self.stream=Stream(lambda:Video(file),file)
+    @property
+    def available(self):return self.stream.available
+    def close(self):self.stream.close()
+    def screenshot(self):
+        stamp,img=self.stream.get()
+        scale=min(1280/img.shape[1],720/img.shape[0])
+        return Frame(img,scale,[(img.shape[1]-round(1280/scale))>>1,(img.shape[0]-round(720/scale))>>1],stamp)
+
+class Prefetch:
+    # Double-buffered capture, the next frame already in flight while the current one is being analysed
+    # A frame is handed out only if it started ante seconds after the last input or the last frame handed out, whichever is later, as a sleep before the screenshot would, so nothing stale or repeated is detected
+    # Capture waits until such a frame can be taken, and stops once nobody has asked for a frame for idle seconds, dropping what it holds
+    def __init__(self,screenshot,idle=2):
+        self.screenshot=screenshot
+        self.idle=idle
+        self.lastInput=0
+        self.notBefore=0
+        self.consumed=0
+        self.handed=0
+        self.demand=0
+        self.since=0
+        self.latest=None
+        self.thread=None
+        self.captured=self.delivered=0
+        self.cond=threading.Condition()
+    def input(self):self.lastInput=time.time()
+    def capture(self):
+        while True:
+            with self.cond:
+                if(now:=time.time())-self.demand>self.idle:
+                    self.thread=self.latest=None
+                    return logger.debug(f'Prefetch idle, {self.delivered} of {self.captured} frames handed out')
+                if self.notBefore>now:
+                    self.cond.wait(self.notBefore-now)
+                    continue
+            start=time.time()
+            try:frame=self.screenshot()
+            except Exception as e:frame=e
+            with self.cond:
+                self.latest=start,frame
+                self.captured+=1
+                self.cond.notify_all()
+    def fetch(self,ante):
+        with self.cond:
+            self.demand=time.time()
+            self.notBefore=max(self.notBefore,max(self.lastInput,self.handed)+ante)
+            if self.thread is None:
+                self.since=self.demand # a demand period starts with the thread, nothing captured before it is fresh
+                self.thread=threading.Thread(target=self.capture,daemon=True,name='Prefetch')
+                self.thread.start()
+            if(latest:=self.latest)and latest[0]>=max(self.notBefore,self.since)and latest[0]>self.consumed:
+                self.consumed=latest[0]
+                self.handed=time.time()
+                self.delivered+=1
+                return latest
+            self.cond.wait(.07)
+    def __call__(self,ante=0):
+        while(latest:=self.fetch(ante))is None:
+            schedule.checkSuspend()
+            schedule.checkStop()
+        if isinstance(latest[1],Exception):raise latest[1]
+        return latest[1]
+
 class Device:
-    def __init__(self,name=None):
+    def __init__(self,name=None,prefetch=False):
         if not name:self.I=self.O=Android()
         elif'|'in name:
             self.I,self.O=[self.createDevice(i)for i in name.split('|')]
@@ -37,20 +107,31 @@ class Device:
         else:
             self.I=self.O=self.createDevice(name)
             self.name=self.I.name
-        self.press=self.I.press
-        self.swipe=self.I.swipe
-        setup(self.O)
+        self.prefetch=Prefetch(self.O.screenshot)if prefetch else None
+        setup(self.O,self.prefetch)
     @staticmethod
     def createDevice(name,*args,**kwargs):
+        if name.startswith('stream:'): # capture through a continuous stream instead of one request per frame
+            return Recording(name[7:])if os.path.isfile(name[7:])else Android(convert(name[7:]),*args,stream=True,**kwargs)
         return Android(convert(name),*args,**kwargs)
     @property
     def available(self):return self.I.available and(self.I is self.O or self.O.available)
+    def close(self):
+        for i in{self.I,self.O}:
+            if close:=getattr(i,'close',None):close()
+    def input(self):
+        if self.prefetch:self.prefetch.input()
     def perform(self,pos,wait):[(self.press(i),schedule.sleep(j*.001))for i,j in zip(pos,wait)]
-    def touch(self,pos,wait=0):(self.I.touch(pos),schedule.sleep(wait*.001))
+    def press(self,key):(self.I.press(key),self.input())
+    def swipe(self,begin,end):(self.I.swipe(begin,end),self.input())
+    def touch(self,pos,wait=0):(self.I.touch(pos),self.input(),schedule.sleep(wait*.001))
     enumDevices=Android.enumDevices
     def __getattr__(self,attr):return getattr(self.I,attr,getattr(self.O,attr))
 
-# def connect(name=None,*args,**kwargs):
-#     global device
-#     device=Device(name,*args,**kwargs)
 device=Device()
+def connect(name=None,*args,**kwargs):
+    # Replace the device, releasing the threads and sessions of the previous one
+    global device
+    device.close()
+    device=Device(name,*args,**kwargs)
+    return device
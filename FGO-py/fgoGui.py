@@ -178,7 +178,7 @@ class MainWindow(QMainWindow,Ui_fgoMainWindow):
         if not dialog.exec():return
         text=dialog.textValue().replace(' ','')
         self.config.device=text
-        fgoDevice.device=fgoDevice.Device(text)
+        fgoDevice.connect(text)
         self.LBL_DEVICE.setText(fgoDevice.device.name)
         self.MENU_CONTROL_MAPKEY.setChecked(False)
     def runMain(self):
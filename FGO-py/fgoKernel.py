@@ -20,15 +20,16 @@
 from fgoConst import VERSION
 __version__=VERSION
 __author__='hgjazhgj'
-import logging,numpy,pulp,random,re,time,threading
+import cv2,inspect,logging,numpy,os,pulp,random,re,time,threading
 import fgoDevice
 from itertools import permutations
 from functools import wraps
-from fgoDetect import Detect,XDetect
+from fgoDetect import Detect,Screen,XDetect
 from fgoFuse import fuse
 from fgoImageListener import ImageListener
 from fgoLogging import getLogger,logit
-from fgoMetadata import servantData,missionMat,missionTag,missionQuest
+from fgoMatch import Identity
+from fgoMetadata import servantData,servantIndex,missionMat,missionTag,missionQuest,chapterImg,questImg
 from fgoReishift import reishift
 from fgoSchedule import ScriptStop,schedule
 logger=getLogger('Kernel')
@@ -36,47 +37,39 @@ logger=getLogger('Kernel')
 friendImg=ImageListener('fgoImage/friend/')
 mailImg=ImageListener('fgoImage/mail/')
 mutex=threading.Lock()
+STORY=(Screen.STORY_SKIP_CONFIRM,Screen.STORY_SKIP_BUTTON,Screen.STORY_PLAYING)
 
-def skipStory():
+def skipStory(det=None):
     """
     检测并跳过剧情
     流程：
     1. 检测确认弹窗 → 点击"是"(825,557)
     2. 检测跳过按钮(右上角) → 点击(1189,44)
     3. 检测剧情播放界面(右下角菜单) → 点击屏幕继续/点击菜单
+    det: 已有的截图，省略时获取新截图
     """
-    # 获取新截图进行检测
-    det = Detect(0, .3)
-    
-    # 1. 如果检测到确认弹窗，直接点击"是"
-    if hasattr(det.tmpl, 'STORYSKIPCONFIRM') and det.isStorySkipConfirm():
-        logger.info('Confirm dialog detected, clicking "Yes" (825, 557)...')
-        fgoDevice.device.touch((825, 557))
-        schedule.sleep(1.0)
-        return True
-    
-    # 2. 如果检测到跳过按钮，点击它
-    if hasattr(det.tmpl, 'STORYSKIPBUTTON') and det.isStorySkipButton():
-        logger.info('Story skip button detected, clicking (1189, 44)...')
-        fgoDevice.device.touch((1189, 44))
-        schedule.sleep(0.8)
-        # 检测确认弹窗
-        det = Detect(0, .3)
-        if hasattr(det.tmpl, 'STORYSKIPCONFIRM') and det.isStorySkipConfirm():
+    match(Detect(0,.3)if det is None else det).classifyScreen(STORY)[0]:
+        case Screen.STORY_SKIP_CONFIRM:
+            # 1. 如果检测到确认弹窗，直接点击"是"
             logger.info('Confirm dialog detected, clicking "Yes" (825, 557)...')
-            fgoDevice.device.touch((825, 557))
+            fgoDevice.device.touch((825,557))
             schedule.sleep(1.0)
-        return True
-    
-    # 3. 如果检测到剧情播放界面（右下角有菜单按钮），点击屏幕继续剧情
-    if hasattr(det.tmpl, 'STORYMENU') and det.isStoryPlaying():
-        logger.info('Story playing detected, tapping screen to continue...')
-        # 点击屏幕中央继续剧情，可能会弹出跳过按钮
-        fgoDevice.device.touch((640, 360))
-        schedule.sleep(0.5)
-        return True
-    
-    return False
+        case Screen.STORY_SKIP_BUTTON:
+            # 2. 如果检测到跳过按钮，点击它，再检测确认弹窗
+            logger.info('Story skip button detected, clicking (1189, 44)...')
+            fgoDevice.device.touch((1189,44))
+            schedule.sleep(0.8)
+            if Detect(0,.3).classifyScreen((Screen.STORY_SKIP_CONFIRM,))[0]:
+                logger.info('Confirm dialog detected, clicking "Yes" (825, 557)...')
+                fgoDevice.device.touch((825,557))
+                schedule.sleep(1.0)
+        case Screen.STORY_PLAYING:
+            # 3. 如果检测到剧情播放界面（右下角有菜单按钮），点击屏幕中央继续剧情，可能会弹出跳过按钮
+            logger.info('Story playing detected, tapping screen to continue...')
+            fgoDevice.device.touch((640,360))
+            schedule.sleep(0.5)
+        case _:return False
+    return True
 def serialize(lock):
     def decorator(func):
         @wraps(func)
@@ -178,6 +171,11 @@ def bench(times=20,touch=True,screenshot=True):
         begin=time.time()
         fgoDevice.device.screenshot()
         screenshotBench.append(time.time()-begin)
+    foregroundBench=[]
+    for _ in range(times*screenshot): # what every screenshot used to pay before the foreground app was watched in background
+        begin=time.time()
+        fgoDevice.device.isForeground()
+        foregroundBench.append(time.time()-begin)
     touchBench=[]
     for _ in range(times*touch):
         begin=time.time()
@@ -187,6 +185,160 @@ def bench(times=20,touch=True,screenshot=True):
         'type':'Bench',
         'touch':(sum(touchBench)-max(touchBench)-min(touchBench))*1000/(times-2)if touch else None,
         'screenshot':(sum(screenshotBench)-max(screenshotBench)-min(screenshotBench))*1000/(times-2)if screenshot else None,
+        'foreground':(sum(foregroundBench)-max(foregroundBench)-min(foregroundBench))*1000/(times-2)if screenshot else None,
+    }
+def benchDetect(times=20,file=None):
+    # Every argument-free is* API on one frame, as shipped and as before, with the all-255 masks opaque templates used to carry and no prefilter
+    cls=XDetect.provider.get(XDetect.region,XDetect.provider['CN'])
+    det=cls.__new__(cls).inject(cv2.imread(file))if file else cls()
+    mask=Identity()
+    opaque=lambda img:img if img[1]is not None else(img[0],mask(img[:1],lambda:numpy.full(img[0].shape[:2],255,numpy.uint8)))
+    masked=(lambda x:x.__new__(x).inject(det.im))(type(cls.__name__,(cls,),{
+        '_loc':lambda self,img,rect=(0,0,1280,720),level=0:cls._loc(self,opaque(img),rect,level),
+        '_count':lambda self,img,rect=(0,0,1280,720),threshold=.1:cls._count(self,opaque(img),rect,threshold),
+        '_reject':lambda self,*args:False,
+    }))
+    def run(det,name):
+        bench=[]
+        for _ in range(times):
+            det.memo.clear()
+            begin=time.perf_counter()
+            getattr(det,name)()
+            bench.append(time.perf_counter()-begin)
+        return(sum(bench)-max(bench)-min(bench))*1000/(times-2)
+    api={}
+    prefilter=cls.prefilterStat()
+    for i in(i for i in dir(cls)if i.startswith('is')and len(inspect.signature(getattr(cls,i)).parameters)==1):
+        try:api[i]=[run(det,i),run(masked,i)]
+        except Exception as e:logger.debug(f'Skip {i}: {e!r}')
+    return{
+        'type':'BenchDetect',
+        'api':api,
+        'fast':sum(i[0]for i in api.values()),
+        'masked':sum(i[1]for i in api.values()),
+        'prefilter':{k:v-prefilter[k]for k,v in cls.prefilterStat().items()},
+    }
+def screenshots(path):return[os.path.join(path,i)for i in sorted(os.listdir(path))if i.endswith('.png')]if os.path.isdir(path)else[path]
+def synthesize(path,count,paste,seed=0):
+    # Screenshots for the verify* tools without a device: templates pasted where they are searched, onto the screenshots in doc, or onto blurred noise if there are none, plus a little capture noise
+    rng=numpy.random.default_rng(seed)
+    background=[cv2.resize(cv2.imread(i),(1280,720))for i in screenshots('../doc')]if os.path.isdir('../doc')else[]
+    for n in range(count):
+        img=background[rng.integers(len(background))].copy()if background else cv2.GaussianBlur(rng.integers(0,256,(720,1280,3),numpy.uint8),(15,15),0)
+        paste(img,lambda rect,tmpl,mask=None:(lambda x,y,h,w:img[y:y+h,x:x+w].__setitem__(...,tmpl if mask is None else numpy.where(mask[...,None]>127,tmpl,img[y:y+h,x:x+w])))(rng.integers(rect[0],rect[2]-tmpl.shape[1]+1),rng.integers(rect[1],rect[3]-tmpl.shape[0]+1),*tmpl.shape[:2]),lambda x:x[rng.integers(len(x))])
+        cv2.imwrite(os.path.join(path,f'{n}.png'),numpy.clip(img+rng.integers(-3,4,img.shape),0,255).astype(numpy.uint8))
+    return path
+def synthesizePyramid(path,count=12,seed=4):
+    # Two chapters, a free quest and five mails per screenshot, in the areas findChapter, isQuestFreeContains and findMail search, the corpus verifyPyramid was checked on
+    def paste(img,place,pick):
+        for _ in range(2):place((640,90,1230,600),pick(list(chapterImg.values())))
+        place((1075,115,1111,575),pick(list(questImg.values())))
+        for _ in range(5):place((73,166,920,720),pick(list(mailImg.flush().values()))[0])
+    return synthesize(path,count,paste,seed)
+def synthesizeServantIndex(path,count=16,seed=11):
+    # A class icon and a portrait strip of a servant of that class at each of the three field positions, the corpus verifyServantIndex was checked on
+    from fgoDetect import CLASS
+    from fgoMetadata import classImg,servantImg
+    def paste(img,place,pick):
+        for pos in range(3):
+            no=pick([i for i in servantData if servantData[i][0]in{j[0]for j in classImg[0]}and servantImg[i][1]])
+            place((13+318*pos,618,117+318*pos,702),*pick([CLASS[125][i]for i,j in enumerate(classImg[0])if j[0]==servantData[no][0]]))
+            place((120+318*pos,421,207+318*pos,490),*pick(servantImg[no][1]))
+    return synthesize(path,count,paste,seed)
+def verifyPyramid(path):
+    # Every coarse-to-fine search against the exhaustive one, on a screenshot or a directory of them, e.g. saved via Detect.cache.save()
+    # Results that differ only by picking another, equally scored occurrence are not mismatches
+    cls=XDetect.provider.get(XDetect.region,XDetect.provider['CN'])
+    def trace(pyramid):
+        def _loc(self,img,rect=(0,0,1280,720),level=0):
+            self.trace=cls._loc(self,img,rect,level*pyramid)
+            return self.trace
+        return type(cls.__name__,(cls,),{'_loc':_loc})
+    full,coarse=trace(False),trace(True)
+    query=[('findMail',k,v)for k,v in mailImg.flush().items()]+[('findFriend',k,v)for k,v in friendImg.flush().items()]+[('findChapter',i,i)for i in chapterImg]+[('isQuestFreeContains',i,i)for i in questImg]
+    mismatch=[]
+    bench=[0,0]
+    for file in screenshots(path):
+        img=cv2.imread(file)
+        for api,name,arg in query:
+            result=[]
+            det=full.__new__(full).inject(img),coarse.__new__(coarse).inject(img)
+            for i in range(2):
+                begin=time.perf_counter()
+                result.append(getattr(det[i],api)(arg))
+                bench[i]+=time.perf_counter()-begin
+            if result[0]!=result[1]and abs(det[0].trace[0]-det[1].trace[0])>1e-6:
+                logger.warning(f'Mismatch {os.path.basename(file)} {api}({name}): {result[0]} -> {result[1]}')
+                mismatch.append((file,api,str(name),*result))
+    return{
+        'type':'VerifyPyramid',
+        'query':len(query),
+        'mismatch':mismatch,
+        'full':bench[0]*1000,
+        'pyramid':bench[1]*1000,
+    }
+def verifyServantIndex(path):
+    # getFieldServant through the index against matching every portrait strip of the class in full, on a screenshot or a directory of them
+    cls=XDetect.provider.get(XDetect.region,XDetect.provider['CN'])
+    mismatch=[]
+    bench=[0,0]
+    count=0
+    for file in screenshots(path):
+        det=cls.__new__(cls).inject(cv2.imread(file))
+        for pos in range(3):
+            if not(rank:=det.getFieldServantClassRank(pos)):continue
+            index=servantIndex[rank[0]]
+            result=[]
+            for i,top in enumerate((None,index.top)):
+                index.top,top=top,index.top
+                begin=time.perf_counter()
+                try:result.append(det.getFieldServant(pos))
+                finally:index.top=top
+                bench[i]+=time.perf_counter()-begin
+            count+=1
+            if result[0]!=result[1]:
+                logger.warning(f'Mismatch {os.path.basename(file)} getFieldServant({pos}): {result[0]} -> {result[1]}')
+                mismatch.append((file,pos,*result))
+    return{
+        'type':'VerifyServantIndex',
+        'query':count,
+        'mismatch':mismatch,
+        'full':bench[0]*1000,
+        'index':bench[1]*1000,
+    }
+def verifyAdb():
+    # fgoAdb.Pool against a stand-in adb server: output, exit status and stderr, a reconnection after every session is dropped, and concurrent requests, whose time is reported
+    # The stand-in runs the local sh, so where there is none (Windows) nothing is checked and the reason is reported instead
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    from airtest.core.error import AdbShellError
+    from fgoAdb import Pool
+    from fgoAdbFake import FakeServer
+    if shutil.which('sh')is None:return{'type':'VerifyAdb','skip':'no sh to run the stand-in adb server'}
+    server=FakeServer()
+    pool=Pool(server.serial,server.addr)
+    failure=[]
+    check=lambda name,ok:ok or failure.append(name)
+    try:
+        check('output',pool.shell('echo hello; printf tail')=='hello\ntail')
+        check('binary',pool.raw_shell("printf '\\0\\377'",False)==b'\0\xff')
+        check('stdin',pool.shell('cat')=='')
+        try:check('status',pool.shell('echo out; echo err >&2; exit 3')and False)
+        except AdbShellError as e:check('status',(e.stdout,e.stderr)==('out\n','err\n'))
+        server.kill()
+        check('reconnect',pool.shell(['echo','back again'])=='back again\n')
+        begin=time.perf_counter()
+        with ThreadPoolExecutor(8)as executor:result=list(executor.map(lambda i:pool.shell(f'sleep .3; echo {i}'),range(8)))
+        concurrent=time.perf_counter()-begin
+        check('concurrent',result==[f'{i}\n'for i in range(8)])
+    finally:
+        pool.close()
+        server.close()
+    return{
+        'type':'VerifyAdb',
+        'failure':failure,
+        'session':server.count,
+        'concurrent':concurrent*1000,
     }
 @serialize(mutex)
 def goto(quest):
@@ -404,7 +556,7 @@ class Turn:
                 else:...
     @logit(logger,logging.INFO)
     def selectCard(self):
-        color,sealed,hougu,np,resist,critical,group=Detect().getCardColor()+[i[5][1]for i in self.servant],Detect.cache.isCardSealed(),Detect.cache.isHouguReady(),[Detect.cache.getFieldServantNp(i)<100 for i in range(3)],[[1,1.7,.6][i]for i in Detect.cache.getCardResist()],[i/10 for i in Detect.cache.getCardCriticalRate()],[next(j for j,k in enumerate(self.servant)if k[0]==i)for i in Detect.cache.getCardServant([i[0] for i in self.servant if i[0]])]+[0,1,2]
+        color,sealed,hougu,np,resist,critical,group=Detect().getCardColor()+[i[5][1]for i in self.servant],Detect.cache.isCardSealed(),Detect.cache.isHouguReady(),[Detect.cache.getFieldServantNp(i)<100 for i in range(3)],[[1,1.7,.6][i]for i in Detect.cache.getCardResist()],[i/10 for i in Detect.cache.getCardCriticalRate()],(lambda slot:[slot[i]for i in Detect.cache.getCardServantScore([self.servant[i][0]for i in slot]).argmin(1)])([i for i in range(3)if self.servant[i][0]])+[0,1,2]
         houguTargeted,houguArea,houguSupport=[[j for j in range(3)if hougu[j]and self.servant[j][0]and self.servant[j][5][0]==i]for i in range(3)]
         houguArea=houguArea if self.stage==self.stageTotal or sum(i>0 for i in self.enemy)>1 and sum(self.enemy)>12000 else[]
         houguTargeted=houguTargeted if self.stage==self.stageTotal or max(self.enemy)>23000+8000*len(houguArea)else[]
@@ -455,39 +607,41 @@ class Battle:
         self.turn=0
         self.turnProc=turnClass()
         self.rainbowBox=False
-    def handleStory(self):
+    def handleStory(self,det=None):
         """处理剧情跳过，返回True表示检测到并处理了剧情"""
         if not self.skipStoryEnabled:
             return False
-        return skipStory()
+        return skipStory(det)
     def __call__(self):
         self.start=time.time()
         self.material={}
+        servantIndex.prefetch() # the team is only seen at the first turn, so every class is warmed while the battle loads
         while True:
-            # 优先检测剧情
-            if self.handleStory():
-                continue
-            if Detect(0,.3).isTurnBegin():
-                self.turn+=1
-                self.turnProc(self.turn)
-            elif Detect.cache.isSpecialDropSuspended():
-                schedule.checkKizunaReisou()
-                logger.warning('Kizuna Reisou')
-                Detect.cache.save('fgoLog/SpecialDrop')
-                fgoDevice.device.press('\x1B')
-            elif not self.rainbowBox and Detect.cache.isSpecialDropRainbowBox():self.rainbowBox=True
-            elif Detect.cache.isBattleFinished():
-                logger.info('Battle Finished')
-                self.material=Detect(.4).getMaterial()
-                if self.rainbowBox:
-                    logger.warning('Special Drop')
-                    schedule.checkSpecialDrop()
+            # 优先检测剧情，与其余界面在同一张截图上一次判定
+            match(det:=Detect(0,.3)).classifyScreen(STORY*self.skipStoryEnabled+(Screen.TURN_BEGIN,Screen.SPECIAL_DROP_SUSPENDED)+(Screen.SPECIAL_DROP_RAINBOW_BOX,)*(not self.rainbowBox)+(Screen.BATTLE_FINISHED,Screen.BATTLE_DEFEATED))[0]:
+                case Screen.STORY_SKIP_CONFIRM|Screen.STORY_SKIP_BUTTON|Screen.STORY_PLAYING:
+                    if self.handleStory(det):continue
+                case Screen.TURN_BEGIN:
+                    self.turn+=1
+                    self.turnProc(self.turn)
+                case Screen.SPECIAL_DROP_SUSPENDED:
+                    schedule.checkKizunaReisou()
+                    logger.warning('Kizuna Reisou')
                     Detect.cache.save('fgoLog/SpecialDrop')
-                return True
-            elif Detect.cache.isBattleDefeated():
-                logger.warning('Battle Defeated')
-                schedule.checkDefeated()
-                return False
+                    fgoDevice.device.press('\x1B')
+                case Screen.SPECIAL_DROP_RAINBOW_BOX:self.rainbowBox=True
+                case Screen.BATTLE_FINISHED:
+                    logger.info('Battle Finished')
+                    self.material=Detect(.4).getMaterial()
+                    if self.rainbowBox:
+                        logger.warning('Special Drop')
+                        schedule.checkSpecialDrop()
+                        Detect.cache.save('fgoLog/SpecialDrop')
+                    return True
+                case Screen.BATTLE_DEFEATED:
+                    logger.warning('Battle Defeated')
+                    schedule.checkDefeated()
+                    return False
             fgoDevice.device.perform('\xBB\x08',(100,100))
     @property
     def result(self):
@@ -510,47 +664,49 @@ class Main:
         while True:
             self.battleProc=self.battleClass()
             while True:
-                # 优先检测剧情，无论当前在什么界面
-                if skipStory():
-                    schedule.sleep(0.5)
-                    continue
-                if Detect(.5,.5).isMainInterface():
-                    if self.battleCount==battleTotal:return logger.info('Operation Unit Completed')
-                    fgoDevice.device.press('84L'[questIndex])
-                    questIndex=0
-                    schedule.sleep(0.8)  # 等待关卡加载
-                    if Detect(1.2).isBattleContinue():fgoDevice.device.press('K')
-                    elif Detect.cache.isSkillCastFailed():
+                # 优先检测剧情，无论当前在什么界面；所有候选界面在同一张截图上一次判定
+                match(det:=Detect(.5,.5)).classifyScreen(STORY+(Screen.MAIN_INTERFACE,Screen.BATTLE_CONTINUE,Screen.SKILL_CAST_FAILED,Screen.TURN_BEGIN,Screen.ADD_FRIEND,Screen.SPECIAL_DROP_SUSPENDED))[0]:
+                    case Screen.STORY_SKIP_CONFIRM|Screen.STORY_SKIP_BUTTON|Screen.STORY_PLAYING:
+                        skipStory(det)
+                        schedule.sleep(0.5)
+                        continue
+                    case Screen.MAIN_INTERFACE:
+                        if self.battleCount==battleTotal:return logger.info('Operation Unit Completed')
+                        fgoDevice.device.press('84L'[questIndex])
+                        questIndex=0
+                        schedule.sleep(0.8)  # 等待关卡加载
+                        if Detect(1.2).isBattleContinue():fgoDevice.device.press('K')
+                        elif Detect.cache.isSkillCastFailed():
+                            fgoDevice.device.press('J')
+                            return logger.info('No Storm Pot')
+                        if Detect(.7,.5).isApEmpty()and not self.eatApple():return logger.info('Ap Empty')
+                        self.chooseFriend()
+                        while not Detect(0.3,.5).isBattleFormation():
+                            if skipStory(Detect.cache):
+                                schedule.sleep(0.5)
+                                continue  # 等待编队时也检测剧情
+                            schedule.sleep(0.3)
+                        schedule.sleep(0.5)  # 等待编队界面完全加载
+                        if self.teamIndex and Detect.cache.getTeamIndex()+1!=self.teamIndex:fgoDevice.device.perform('\x70\x71\x72\x73\x74\x75\x76\x77\x78\x79\x7A\x7B\x7C\x7D\x7E'[self.teamIndex-1],(1000,))
+                        if self.autoFormation:fgoDevice.device.perform('\xDEL ',(1500,2000,1500))
+                        fgoDevice.device.perform(' M ',(2500,2500,10000))
+                        break
+                    case Screen.BATTLE_CONTINUE:
+                        if self.battleCount==battleTotal:
+                            fgoDevice.device.press('F')
+                            return logger.info('Operation Unit Completed')
+                        fgoDevice.device.press('K')
+                        schedule.sleep(0.5)
+                        if Detect(.7,.5).isApEmpty()and not self.eatApple():return logger.info('Ap Empty')
+                        self.chooseFriend()
+                        schedule.sleep(6)
+                        break
+                    case Screen.SKILL_CAST_FAILED:
                         fgoDevice.device.press('J')
                         return logger.info('No Storm Pot')
-                    if Detect(.7,.5).isApEmpty()and not self.eatApple():return logger.info('Ap Empty')
-                    self.chooseFriend()
-                    while not Detect(0.3,.5).isBattleFormation():
-                        if skipStory():
-                            schedule.sleep(0.5)
-                            continue  # 等待编队时也检测剧情
-                        schedule.sleep(0.3)
-                    schedule.sleep(0.5)  # 等待编队界面完全加载
-                    if self.teamIndex and Detect.cache.getTeamIndex()+1!=self.teamIndex:fgoDevice.device.perform('\x70\x71\x72\x73\x74\x75\x76\x77\x78\x79\x7A\x7B\x7C\x7D\x7E'[self.teamIndex-1],(1000,))
-                    if self.autoFormation:fgoDevice.device.perform('\xDEL ',(1500,2000,1500))
-                    fgoDevice.device.perform(' M ',(2500,2500,10000))
-                    break
-                elif Detect.cache.isBattleContinue():
-                    if self.battleCount==battleTotal:
-                        fgoDevice.device.press('F')
-                        return logger.info('Operation Unit Completed')
-                    fgoDevice.device.press('K')
-                    schedule.sleep(0.5)
-                    if Detect(.7,.5).isApEmpty()and not self.eatApple():return logger.info('Ap Empty')
-                    self.chooseFriend()
-                    schedule.sleep(6)
-                    break
-                elif Detect.cache.isSkillCastFailed():
-                    fgoDevice.device.press('J')
-                    return logger.info('No Storm Pot')
-                elif Detect.cache.isTurnBegin():break
-                elif Detect.cache.isAddFriend():fgoDevice.device.perform('X',(500,))
-                elif Detect.cache.isSpecialDropSuspended():fgoDevice.device.perform('\x1B',(500,))
+                    case Screen.TURN_BEGIN:break
+                    case Screen.ADD_FRIEND:fgoDevice.device.perform('X',(500,))
+                    case Screen.SPECIAL_DROP_SUSPENDED:fgoDevice.device.perform('\x1B',(500,))
                 # 尝试点击关卡/继续按钮（处理地图界面等未知界面）
                 fgoDevice.device.perform('8 \xBB',(500,400,300))
             self.battleCount+=1
@@ -605,7 +761,7 @@ class Main:
     def chooseFriend(self):
         refresh=False
         while not Detect(0,.3).isChooseFriend():
-            if skipStory():continue  # 选好友时也检测剧情
+            if skipStory(Detect.cache):continue  # 选好友时也检测剧情
             if Detect.cache.isNoFriend():
                 if refresh:schedule.sleep(10)
                 fgoDevice.device.perform('\xBAK',(500,1000))
@@ -0,0 +1,191 @@
+import threading,cv2,numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+class Identity:
+    # Values keyed by the ids of the objects they came from, which the entry holds so the ids stay unique, least recently used dropped beyond size
+    def __init__(self,size=None,stat=None):
+        self.entry={}
+        self.size=size
+        self.stat=[0,0]if stat is None else stat
+        self.lock=threading.Lock()
+    @staticmethod
+    def key(obj,*arg):return(*map(id,obj),*arg)
+    def __contains__(self,key):return key in self.entry
+    def clear(self):
+        with self.lock:self.entry.clear()
+    def __call__(self,obj,func,*arg):
+        key=self.key(obj,*arg)
+        with self.lock:
+            if hit:=(entry:=self.entry.pop(key,None))is not None:self.entry[key]=entry
+            self.stat[not hit]+=1
+        if hit:return entry[1]
+        value=func()
+        with self.lock:
+            entry=self.entry.setdefault(key,(obj,value))
+            while self.size and len(self.entry)>self.size:del self.entry[next(iter(self.entry))]
+        return entry[1]
+
+class Batch:
+    # Equally sized templates scored together as TM_SQDIFF_NORMED, (t-2*I@(T*M)+(I*I)@M)/sqrt(t*(I*I)@M) with binary masks like opencv's
+    def __init__(self,img):
+        self.img=img
+        self.shape=img[0][0].shape
+        tmpl=numpy.stack([i for i,_ in img]).reshape(len(img),-1).astype(numpy.float32)
+        self.mask=None # without masks the energy is a plain window sum
+        if any(j is not None for _,j in img):
+            mask=numpy.stack([numpy.ones(self.shape[:2],numpy.float32)if j is None else(j>0).astype(numpy.float32)for _,j in img])[...,None].repeat(self.shape[2],-1).reshape(len(img),-1)
+            tmpl*=mask
+            self.mask=numpy.ascontiguousarray(mask.T)
+        self.tmpl=numpy.ascontiguousarray(tmpl.T)
+        self.norm=(tmpl*tmpl).sum(1,dtype=numpy.float64)
+        self.clamp=numpy.array([j is None for _,j in img]) # opencv clips unmasked scores to 1 but not masked ones
+    def __call__(self,roi):
+        # equally sized rois, returns the (len(roi),len(img)) best scores
+        window=sliding_window_view(numpy.stack(roi),self.shape,(1,2,3)).reshape(-1,self.tmpl.shape[0]).astype(numpy.float32) # gathered at the width of the source
+        cross=window@self.tmpl
+        window*=window
+        energy=window.sum(1,numpy.float64,keepdims=True)if self.mask is None else window@self.mask
+        denom=numpy.sqrt(self.norm*energy)
+        score=numpy.maximum(self.norm-2*cross+energy,0)/numpy.maximum(denom,1e-6)
+        return numpy.where(denom>1e-6,numpy.where(self.clamp,numpy.minimum(score,1.),score),1.).reshape(len(roi),-1,len(self.img)).min(1)
+
+class Spectrum:
+    # Batch scores from dft correlations, for searches too wide to unfold
+    def __init__(self,img):
+        self.img=img
+        self.shape=img[0][0].shape
+        self.mask=numpy.stack([numpy.ones(self.shape[:2],numpy.float32)if j is None else(j>0).astype(numpy.float32)for _,j in img])
+        self.tmpl=numpy.stack([i for i,_ in img]).astype(numpy.float32)*self.mask[...,None]
+        self.norm=(self.tmpl*self.tmpl).sum((1,2,3),dtype=numpy.float64)[:,None,None]
+        self.clamp=numpy.array([j is None for _,j in img])[:,None,None]
+        self.spectrum={}
+    def transform(self,size):
+        # conjugate spectra of templates and masks, per dft size
+        if size not in self.spectrum:self.spectrum.setdefault(size,(numpy.fft.rfft2(self.tmpl,size,(1,2)).conj(),numpy.fft.rfft2(self.mask,size).conj()))
+        return self.spectrum[size]
+    def __call__(self,roi):
+        roi=numpy.stack(roi).astype(numpy.float32)
+        h,w=roi.shape[1]-self.shape[0]+1,roi.shape[2]-self.shape[1]+1
+        tmpl,mask=self.transform(size:=(cv2.getOptimalDFTSize(roi.shape[1]),cv2.getOptimalDFTSize(roi.shape[2])))
+        cross=numpy.fft.irfft2(numpy.einsum('ryxc,nyxc->rnyx',numpy.fft.rfft2(roi,size,(1,2)),tmpl),size)[...,:h,:w]
+        energy=numpy.maximum(numpy.fft.irfft2(numpy.fft.rfft2((roi*roi).sum(-1),size)[:,None]*mask,size)[...,:h,:w],0) # the mask is shared by the channels
+        denom=numpy.sqrt(self.norm*energy)
+        score=numpy.maximum(self.norm-2*cross+energy,0)/numpy.maximum(denom,1e-6)
+        return numpy.where(denom>1e-6,numpy.where(self.clamp,numpy.minimum(score,1.),score),1.).min((2,3))
+
+batchMin=4 # below this a group is cheaper to match one template at a time in opencv
+spectrumMin=1<<20 # from this many window elements per roi on, unfolding the windows costs more than the dft
+batches=Identity(64)
+def batch(img,engine=Batch):return batches([j for i in img for j in i[:2]],lambda:engine(img),engine)
+def score(img,roi):
+    # templates and rois of any sizes, grouped by shape, returns the (len(roi),len(img)) scores
+    result=numpy.empty((len(roi),len(img)))
+    group=lambda x,f:{s:[i for i in range(len(x))if f(x[i]).shape==s]for s in dict.fromkeys(f(i).shape for i in x)}
+    for i in group(img,lambda x:x[0]).values():
+        for j in group(roi,lambda x:x).values():
+            tmpl,crop=img[i[0]][0],roi[j[0]]
+            engine=(lambda roi,img=[img[k]for k in i]:numpy.array([[cv2.minMaxLoc(cv2.matchTemplate(j,k[0],cv2.TM_SQDIFF_NORMED,mask=k[1]))[0]for k in img]for j in roi]))if len(i)<batchMin else batch([img[k]for k in i],Spectrum if(crop.shape[0]-tmpl.shape[0]+1)*(crop.shape[1]-tmpl.shape[1]+1)*tmpl.size>=spectrumMin else Batch)
+            result[numpy.ix_(j,i)]=engine([roi[k]for k in j])
+    return result
+class Index:
+    # Best (score,key) of equally sized templates, ranked on thumbnails in one Batch and only the top few matched in full
+    def __init__(self,item,scale=4,top=4):
+        self.key,self.img=zip(*item)
+        self.shape=self.img[0][0].shape[:2]
+        self.size=(self.shape[1]//scale,self.shape[0]//scale)
+        self.top=top
+        self.batch=Batch([(cv2.resize(i,self.size,interpolation=cv2.INTER_AREA),None if j is None else(cv2.resize(j,self.size,interpolation=cv2.INTER_AREA)>127).astype(numpy.uint8))for i,j in self.img])
+    def __call__(self,roi):
+        h,w=self.shape
+        rough=self.batch([cv2.resize(roi[y:y+h,x:x+w],self.size,interpolation=cv2.INTER_AREA)for y in range(roi.shape[0]-h+1)for x in range(roi.shape[1]-w+1)]).min(0)
+        return min((cv2.minMaxLoc(match(roi,self.img[i]))[0],self.key[i])for i in numpy.argsort(rough,kind='stable')[:self.top])
+class Sieve:
+    # Equally sized unmasked templates, only those whose block sum bound may pass the threshold are matched in full
+    def __init__(self,img,block=8):
+        self.img=img
+        self.block=block
+        self.shape=img[0][0].shape[:2]
+        self.grid=(self.shape[0]//block,self.shape[1]//block)
+        self.sums=None
+    def prepare(self):
+        # on first use, so a sieve costs nothing at startup
+        tmpl=numpy.stack([i for i,_ in self.img]).astype(numpy.float64)
+        self.norm=(tmpl*tmpl).sum((1,2,3))
+        self.sums=tmpl[:,:self.grid[0]*self.block,:self.grid[1]*self.block].reshape(len(self.img),self.grid[0],self.block,self.grid[1],self.block,-1).sum((2,4)).reshape(len(self.img),-1)
+    def bound(self,roi):
+        # equally sized rois, returns the (len(roi),len(img)) lower bounds
+        if self.sums is None:self.prepare()
+        h,w=self.shape
+        b=self.block
+        s,q=(numpy.stack([numpy.atleast_3d(i)for i in j])for j in zip(*(cv2.integral2(i,sdepth=cv2.CV_64F,sqdepth=cv2.CV_64F)for i in roi)))
+        y=(numpy.arange(s.shape[1]-h)[:,None]+b*numpy.arange(self.grid[0]))[:,None,:,None]
+        x=(numpy.arange(s.shape[2]-w)[:,None]+b*numpy.arange(self.grid[1]))[None,:,None,:]
+        sums=(s[:,y+b,x+b]-s[:,y,x+b]-s[:,y+b,x]+s[:,y,x]).reshape(-1,self.sums.shape[1])
+        denom=numpy.sqrt(self.norm*(q[:,h:,w:]-q[:,:-h,w:]-q[:,h:,:-w]+q[:,:-h,:-w]).sum(-1).reshape(-1,1))
+        diff=numpy.maximum((sums*sums).sum(1,keepdims=True)+(self.sums*self.sums).sum(1)-2*sums@self.sums.T,0)/b**2
+        return numpy.minimum(numpy.where(denom>1e-6,diff/numpy.maximum(denom,1e-6),0.).reshape(len(roi),-1,len(self.img)).min(1),1.)
+    def select(self,roi,threshold):
+        # same as select(img,roi,threshold), with a slack for float32
+        def sift(roi,bound):
+            if not len(cand:=numpy.flatnonzero(bound-1e-4<threshold)):return None
+            score=[cv2.minMaxLoc(match(roi,self.img[i]))[0]for i in cand]
+            return int(cand[i])if score[i:=int(numpy.argmin(score))]<threshold else None
+        return[sift(i,j)for i,j in zip(roi,self.bound(roi))]if roi else[]
+
+def select(img,roi,threshold):return[int(i)if j[i]<threshold else None for j in score(img,roi)for i in(numpy.argmin(j),)]
+
+scaled=Identity(512)
+def pyrDown(img,level):
+    for _ in range(level):img=cv2.pyrDown(img)
+    return img
+def shrink(img,level):
+    # blurred and halved level times, None when too small to carry a peak
+    return scaled(img,lambda:None if min(img[0].shape[:2])>>level<minSide else(pyrDown(img[0],level),None if img[1]is None else pyrDown(img[1],level)),level)
+minSide=6
+def match(roi,img):
+    # nan where the masked roi is black would poison minMaxLoc
+    score=cv2.matchTemplate(roi,img[0],cv2.TM_SQDIFF_NORMED,mask=img[1])
+    if img[1]is not None:score[numpy.isnan(score)]=numpy.inf
+    return score
+def locPyramid(roi,img,level=1,peak=8):
+    # Coarse to fine cv2.minMaxLoc(match(roi,img)), the best peaks on gaussian reduced copies refined in full, see verifyPyramid
+    f=1<<level
+    if level==0 or(small:=shrink(img,level))is None or roi.shape[0]>>level<=small[0].shape[0]or roi.shape[1]>>level<=small[0].shape[1]:return cv2.minMaxLoc(match(roi,img))
+    h,w=img[0].shape[:2]
+    sh,sw=small[0].shape[:2]
+    score=match(pyrDown(roi,level),small)
+    best=(numpy.inf,(0,0))
+    for _ in range(peak):
+        if(loc:=cv2.minMaxLoc(score))[0]==numpy.inf:break
+        x,y=loc[2][0]*f,loc[2][1]*f
+        score[max(0,loc[2][1]-(sh>>1)):loc[2][1]+(sh>>1)+1,max(0,loc[2][0]-(sw>>1)):loc[2][0]+(sw>>1)+1]=numpy.inf
+        x0,y0=max(0,x-f),max(0,y-f)
+        fine=cv2.minMaxLoc(match(roi[y0:min(roi.shape[0],y+f+h),x0:min(roi.shape[1],x+f+w)],img))
+        if fine[0]<best[0]:best=(fine[0],(x0+fine[2][0],y0+fine[2][1]))
+    return best[0],1.,best[1],(0,0)
+
+boundMax=8192 # positions times boxes, beyond which matchTemplate is cheaper
+boundBlock=8
+signature=Identity(512)
+def sign(img):
+    # Boxes for bound, runs of boundBlock rows wholly inside the mask with their sums, and wholly outside it to take off the window energy
+    def build():
+        h,w=img[0].shape[:2]
+        tmpl=numpy.atleast_3d(img[0]).astype(numpy.float64)
+        inside=numpy.ones((h,w),bool)if img[1]is None else img[1]>0
+        run=lambda x:numpy.flatnonzero(numpy.diff(x,prepend=False,append=False)).reshape(-1,2)
+        band=lambda f:[(y,a,y+boundBlock,b)for y in range(0,h-boundBlock+1,boundBlock)for a,b in run(f(inside[y:y+boundBlock]))]
+        inner=numpy.array([(0,0,h,w)]if img[1]is None else band(lambda x:x.all(0)),int).reshape(-1,4).T
+        outer=numpy.array([(0,0,h,w)]+([]if img[1]is None else band(lambda x:~x.any(0))),int).T
+        return inner,numpy.array([tmpl[a:c,b:d].sum((0,1))for a,b,c,d in inner.T]).reshape(-1,tmpl.shape[2]),(inner[2]-inner[0])*(inner[3]-inner[1]),outer,numpy.where(numpy.arange(outer.shape[1]),-1.,1.),numpy.square(tmpl[inside]).sum()
+    return signature(img,build)
+def bound(roi,img):
+    # A lower bound of cv2.minMaxLoc(match(roi,img))[0] from integral images, 0 where it does not apply
+    h,w=img[0].shape[:2]
+    inner,total,n,outer,weight,norm=sign(img)
+    if not len(n)or roi.shape[0]<h or roi.shape[1]<w or(roi.shape[0]-h+1)*(roi.shape[1]-w+1)*(len(n)+len(weight))>boundMax:return 0.
+    y,x=(i[...,None]for i in numpy.ogrid[:roi.shape[0]-h+1,:roi.shape[1]-w+1])
+    box=lambda a,r:(a:=numpy.atleast_3d(a))[y+r[2],x+r[3]]-a[y+r[0],x+r[3]]-a[y+r[2],x+r[1]]+a[y+r[0],x+r[1]]
+    s,q=cv2.integral2(roi,sdepth=cv2.CV_64F,sqdepth=cv2.CV_64F)
+    denom=numpy.sqrt(norm*numpy.maximum(box(q,outer).sum(-1)@weight,0))
+    return min(1.,float(numpy.where(denom>1e-6,numpy.square(box(s,inner)-total).sum(-1)@(1/n)/numpy.maximum(denom,1e-6),0.).min()))
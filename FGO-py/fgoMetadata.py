@@ -1,4 +1,6 @@
-import cv2,numpy,os,tqdm
+import cv2,numpy,threading
+from fgoAsset import asset,parallel,splitAlpha
+from fgoMatch import Index,Sieve
 servantData={
 1:(0,0,6,1,(2,0),((1,0),(2,1),(8,5))),
 2:(1,0,6,1,(1,2),((5,0),(3,5),(2,5))),
@@ -617,15 +619,29 @@ missionMat=numpy.array((
 missionTag=((),('小怪','天'),('小怪','魔术师'),('小怪','门系'),('小怪',),('小怪','人'),('小怪','死灵'),('小怪','魔性'),('小怪','剑士'),('小怪','骷髅系'),('小怪','枪兵'),('小怪','弓兵'),('小怪','地'),('小怪','暗匿者'),('小怪','男性'),('小怪','人型'),('小怪','人类'),('小怪','士兵系'),('小怪','龙'),('小怪','骑兵'),('小怪','双足飞龙系'),('小怪','僵尸系'),('小怪','猛兽'),('小怪','犬型'),('小怪','兽人系'),('小怪','罗马'),('小怪','狂战士'),('小怪','魔偶系'),('小怪','鬼魂系'),('小怪','奇美拉系'),('小怪','寄居蟹系'),('小怪','女性'),('小怪','蛇女系'),('小怪','希腊神话系男性'),('小怪','半人马系'),('小怪','亚马逊系'),('小怪','自动人偶系'),('小怪','人工生命体系'),('小怪','书页系'),('小怪','混沌机械兵系'),('小怪','机械化步兵系'),('小怪','凯尔特士兵系'),('小怪','噬魂者系'),('小怪','恶魔'),('小怪','凝视者系'),('小怪','双角兽系'),('小怪','超巨大'),('小怪','守护者系'),('小怪','神性'),('小怪','斯芬克斯系'),('小怪','伊夫利塔系'),('小怪','失心者系'),('小怪','骑士系'),('小怪','自动防卫装置系'),('小怪','乌利迪姆系'),('小怪','乌伽尔系'),('小怪','穆修胡休系'),('小怪','海魔系'),('小怪','巨龙系'),('小怪','魔猪系'),('小怪','巨大魔猪系'),('小怪','恶'),('小怪','小混混系'),('小怪','雀蜂系'),('小怪','王'),('小怪','流氓系'),('小怪','恶魔系'),('小怪','女海盗系'),('小怪','酷吏系'),('小怪','许德拉系'),('小怪','黑武者系'),('小怪','鬼'),('小怪','秽神系'),('小怪','灰狼系'),('小怪','食尸鬼系'),('小怪','夏塔克鸟系'),('小怪','雅嘎系'),('小怪','杀戮猎兵系'),('小怪','巨人'),('小怪','瓦尔基里系'),('小怪','坦克系'),('小怪','禁卫兵系'),('小怪','迦利系'),('小怪','伟大那伽系'),('小怪','刻耳柏洛斯系'),('小怪','亚特兰蒂斯防卫兵系'),('小怪','广域歼灭兵器系'),('小怪','奥林波斯兵系'),('小怪','土蜘蛛系'),('小怪','大翁鬼系'),('小怪','机械'),('小怪','小鬼系'),('小怪','妖精'),('小怪','复仇者'),('小怪','摩尔斯系'),('小怪','牙之氏族系'),('小怪','肃正骑士系'),('小怪','龙系'),('小怪','摩根兵系'),('小怪','皮克特人系'),('小怪','巨人系'),('小怪','翅刃虫系'),('小怪','从者','男性'),('小怪','从者','暗匿者'),('小怪','从者','狂战士'),('小怪','从者','人'),('小怪','从者','人型'),('小怪','职阶从者系'),('小怪','从者'),('小怪','从者','女性'),('小怪','从者','剑士'),('小怪','从者','魔术师'),('小怪','从者','死灵'),('小怪','从者','天'),('小怪','从者','魔性'),('小怪','从者','枪兵'),('小怪','斩首鸡系'),('小怪','从者','弓兵'),('小怪','从者','骑兵'),('小怪','从者','骑乘'),('小怪','咒毒虫系'),('从者','地'),('从者','女性'),('从者','人型'),('从者','神性'),('从者','骑乘'),('从者','骑兵'),('从者','混沌'),('从者','善'),('从者',),('从者','人'),('从者','男性'),('从者','所爱之人'),('从者','枪兵'),('从者','暗匿者'),('从者','和风'),('从者','秩序'),('从者','恶'),('从者','王'),('从者','龙'),('从者','剑士'),('从者','阿尔托莉雅脸'),('从者','幸运A+以上'),('从者','狂战士'),('从者','狂'),('从者','魔术师'),('从者','裁定者'),('从者','罗马'),('从者','中立'),('从者','中庸'),('从者','星'),('从者','希腊神话系男性'),('从者','天'),('从者','太阳'),('从者','弓兵'),('从者','人类'),('从者','哈桑系'),('从者','猛兽'),('从者','复仇者'),('从者','犬型'),('从者','魔性'),('从者','其他性别'),('从者','阿耳戈船相关人员'),('从者','天地从者'),('从者','人科'),('从者','源氏'),('从者','孩童从者'),('从者','鬼'),('从者','妖精'),('从者','圆桌骑士'),('从者','魔兽型'),('场地','燃烧'),('场地','都市'),('场地','城市'),('场地','地下'),('场地','阳光照射'),('场地','山丘'),('场地','森林'),('场地','城池'),('场地','荒野'),('场地','山'),('场地','水边'),('场地','沙滩·沙漠'),('场地','神殿'),('场地','岩山'),('场地','草原'))
 missionQuest=((0,0,0),(1,0,0,0),(1,0,1,0),(1,0,2,0),(1,0,3,0),(1,0,4,0),(1,0,5,0),(1,0,6,0),(1,0,7,0),(1,1,0,0),(1,1,1,0),(1,1,2,0),(1,1,3,0),(1,1,4,0),(1,1,5,0),(1,1,6,0),(1,1,7,0),(1,1,8,0),(1,1,9,0),(1,2,0,0),(1,2,1,0),(1,2,2,0),(1,2,3,0),(1,2,4,0),(1,2,5,0),(1,2,6,0),(1,2,7,0),(1,2,8,0),(1,2,9,0),(1,2,10,0),(1,3,0,0),(1,3,1,0),(1,3,2,0),(1,3,3,0),(1,3,4,0),(1,3,5,0),(1,3,6,0),(1,3,7,0),(1,3,7,1),(1,3,8,0),(1,3,9,0),(1,3,10,0),(1,4,0,0),(1,4,1,0),(1,4,2,0),(1,4,3,0),(1,4,4,0),(1,4,5,0),(1,4,6,0),(1,4,7,0),(1,4,8,0),(1,5,0,0),(1,5,1,0),(1,5,2,0),(1,5,3,0),(1,5,4,0),(1,5,5,0),(1,5,6,0),(1,5,7,0),(1,5,8,0),(1,5,9,0),(1,5,10,0),(1,5,11,0),(1,5,12,0),(1,5,13,0),(1,6,0,0),(1,6,1,0),(1,6,2,0),(1,6,3,0),(1,6,4,0),(1,6,5,0),(1,6,6,0),(1,6,7,0),(1,6,8,0),(1,6,9,0),(1,6,10,0),(1,6,11,0),(1,6,12,0),(1,6,13,0),(1,7,0,0),(1,7,1,0),(1,7,2,0),(1,7,3,0),(1,7,4,0),(1,7,5,0),(1,7,6,0),(1,7,7,0),(1,7,8,0),(1,7,9,0),(1,7,10,0),(1,7,11,0),(1,7,12,0),(1,7,13,0),(2,0,0,0),(2,0,1,0),(2,0,2,0),(2,0,3,0),(2,0,4,0),(2,0,5,0),(2,0,6,0),(2,0,7,0),(2,0,8,0),(2,0,9,0),(2,1,0,0),(2,1,1,0),(2,1,2,0),(2,1,3,0),(2,1,4,0),(2,1,5,0),(2,1,6,0),(2,1,7,0),(2,1,8,0),(2,1,9,0),(2,1,10,0),(2,1,11,0),(2,2,0,0),(2,2,1,0),(2,2,2,0),(2,2,3,0),(2,2,4,0),(2,2,5,0),(2,2,6,0),(2,2,6,1),(2,2,7,0),(2,3,0,0),(2,3,1,0),(2,3,2,0),(2,3,3,0),(2,3,4,0),(2,3,5,0),(2,3,6,0),(2,3,7,0),(2,3,8,0),(2,3,9,0),(2,3,10,0),(3,0,0,0),(3,0,1,0),(3,0,2,0),(3,0,3,0),(3,0,4,0),(3,0,5,0),(3,0,6,0),(3,0,7,0),(3,0,8,0),(3,0,9,0),(3,0,10,0),(3,0,11,0),(3,0,12,0),(3,0,13,0),(3,1,0,0),(3,1,1,0),(3,1,2,0),(3,1,3,0),(3,1,4,0),(3,1,5,0),(3,1,6,0),(3,1,7,0),(3,1,8,0),(3,1,9,0),(3,1,10,0),(3,2,0,0),(3,2,1,0),(3,2,2,0),(3,2,3,0),(3,2,4,0),(3,2,5,0),(3,2,6,0),(3,2,7,0),(3,2,8,0),(3,2,9,0),(3,2,10,0),(3,3,0,0),(3,3,1,0),(3,3,2,0),(3,3,3,0),(3,3,4,0),(3,3,5,0),(3,3,6,0),(3,3,7,0),(3,3,8,0),(3,3,9,0),(3,4,0,0),(3,4,1,0),(3,4,2,0),(3,4,3,0),(3,4,4,0),(3,4,5,0),(3,4,6,0),(3,4,7,0),(3,4,8,0),(3,5,0,0),(3,5,1,0),(3,5,2,0),(3,5,3,0),(3,5,4,0),(3,5,5,0),(3,5,6,0),(3,5,7,0),(3,5,8,0),(3,5,9,0),(3,5,10,0),(4,0,0,0),(4,0,1,0),(4,0,2,0),(4,0,3,0),(4,0,4,0),(4,0,5,0),(4,0,6,0),(4,0,7,0),(4,0,8,0),(4,0,9,0),(4,0,10,0),(4,0,11,0),(4,0,12,0),(3,6,0,0),(3,6,1,0),(3,6,2,0),(3,6,3,0),(3,6,4,0),(3,6,5,0),(3,6,6,0),(3,6,7,0),(3,6,8,0),(3,6,9,0),(3,6,10,0),(3,6,11,0),(3,6,12,0),(3,6,13,0),(3,6,14,0),(3,6,15,0),(4,1,0,0),(4,1,1,0),(4,1,2,0),(4,1,3,0),(4,1,4,0),(4,1,5,0),(4,1,6,0),(4,1,7,0),(4,1,8,0),(4,1,9,0),(4,1,10,0),(4,1,11,0),(4,1,12,0),(4,1,13,0),(4,1,14,0),(4,1,15,0))
 quest=missionQuest+((3,7,0,0),(3,7,1,0),(3,7,2,0),(3,7,3,0),(3,7,4,0),(3,7,5,0),(3,7,6,0),(3,7,7,0),(3,7,8,0),(3,7,9,0),(3,7,10,0),(3,7,11,0),(3,7,12,0),(3,7,13,0),(3,7,14,0),(3,7,15,0),(5,0,0,0),(5,0,1,0),(5,0,2,0),(5,0,2,1),(5,0,3,0),(5,0,4,0),(5,0,5,0),(5,0,6,0),(5,0,7,0),(5,0,8,0),(5,0,9,0),(5,0,10,0),(5,0,11,0),(5,0,11,1),(5,0,12,0),(5,0,13,0),(5,0,14,0),(5,1,0,0),(5,1,1,0),(5,1,2,0),(5,1,3,0),(5,1,4,0),(5,1,5,0),(5,1,6,0),(5,1,7,0),(5,1,8,0),(5,1,9,0),(5,1,10,0))
-def readSplit(file,height):return(lambda img:[(lambda x:(x[...,:3],x[...,3]))(img[i*height:(i+1)*height])for i in range(img.shape[0]//height)])(cv2.imread(file,cv2.IMREAD_UNCHANGED))
-servantImg={i:(
-    readSplit(f'fgoImage/servant/{i}/card.png',47),
-    readSplit(f'fgoImage/servant/{i}/portrait.png',63),
-    None,# readSplit(f'fgoImage/servant/{i}/tachie.png',),
-)for i in tqdm.tqdm(servantData,leave=False)}
-classImg=(lambda f:[[[int(j)for j in i[:-4].split('-')]for i in f],[(lambda x:(x[...,:3],x[...,3]))(cv2.imread(f'fgoImage/class/{i}',cv2.IMREAD_UNCHANGED))for i in f]])(os.listdir('fgoImage/class'))
-materialImg=[(i[:-4],cv2.imread(f'fgoImage/material/{i}'))for i in os.listdir('fgoImage/material')if i.endswith('.png')]
-chapterImg={tuple(int(i)for i in i[:-4].split('-')):cv2.imread(f'fgoImage/map/entrance/{i}')for i in os.listdir('fgoImage/map/entrance')}
-mapImg={tuple(int(i)for i in i[:-4].split('-')):cv2.imread(f'fgoImage/map/atlas/{i}')for i in os.listdir('fgoImage/map/atlas')}
-questImg={int(i[:-4]):cv2.imread(f'fgoImage/map/{i}')for i in os.listdir('fgoImage/map')if i.endswith('.png')}
+def readSplit(file,height):return(lambda img:[splitAlpha(img[i*height:(i+1)*height])for i in range(img.shape[0]//height)])(asset.imread(file,cv2.IMREAD_UNCHANGED))
+class ServantImg(dict):
+    # Card and portrait strips of a servant are decoded the first time that servant is looked up
+    def __missing__(self,key):
+        if key not in servantData:raise KeyError(key)
+        self[key]=value=(
+            readSplit(f'fgoImage/servant/{key}/card.png',47),
+            readSplit(f'fgoImage/servant/{key}/portrait.png',63),
+            None,# readSplit(f'fgoImage/servant/{key}/tachie.png',),
+        )
+        return value
+servantImg=ServantImg()
+class ServantIndex(dict):
+    # Portrait strips of every servant of a class in one recognition index, built the first time that class is looked up
+    def __missing__(self,key):
+        self[key]=value=Index([(no,i)for no in servantData if servantData[no][0]==key for i in servantImg[no][1]])
+        return value
+    def prefetch(self,cls=None):threading.Thread(target=lambda:(lambda cls:(parallel(servantImg.__getitem__,[i for i in servantData if servantData[i][0]in cls]),parallel(self.__getitem__,cls)))([i for i in(cls or{servantData[i][0]for i in servantData})if i not in self]),daemon=True,name='ServantPrefetch').start() # warms the classes in the background, every class if none are given
+servantIndex=ServantIndex()
+classImg=(lambda f:[[[int(j)for j in i[:-4].split('-')]for i in f],[splitAlpha(i)for i in f.values()]])(asset.imreadDir('fgoImage/class',cv2.IMREAD_UNCHANGED))
+materialImg=[(i[:-4],j)for i,j in asset.imreadDir('fgoImage/material').items()]
+materialIndex=Sieve([(j,None)for _,j in materialImg])
+chapterImg={tuple(int(i)for i in i[:-4].split('-')):j for i,j in asset.imreadDir('fgoImage/map/entrance').items()}
+mapImg={tuple(int(i)for i in i[:-4].split('-')):j for i,j in asset.imreadDir('fgoImage/map/atlas').items()}
+questImg={int(i[:-4]):j for i,j in asset.imreadDir('fgoImage/map').items()}
 questImg[4]=questImg[3]
@@ -1,3 +1,4 @@
+import threading
 from pponnxcr import TextSystem
 from fgoLogging import getLogger,logit
 logger=getLogger('Ocr')
@@ -8,3 +9,29 @@ class Ocr(TextSystem):
     def ocrText(self,img):return self(img)
     @logit(logger,transform=lambda x:'|'.join(x))
     def ocrArea(self,img):return[i.text for i in self.detect_and_ocr(img)]
+class OcrPool:
+    # Models are created on first use of their language, preload and unload let the caller keep only what the connected device needs
+    def __init__(self,*lang):
+        self.lang=lang
+        self.pool={}
+        self.mutex=threading.Lock()
+    def __getattr__(self,lang):
+        if lang not in self.lang:raise AttributeError(lang)
+        with self.mutex:
+            if lang not in self.pool:
+                logger.info(f'Load {lang}')
+                self.pool[lang]=Ocr(lang)
+            return self.pool[lang]
+    def lazy(self,lang):return LazyOcr(self,lang)
+    def preload(self,*lang):
+        for i in lang:getattr(self,i)
+    def unload(self,*keep):
+        with self.mutex:
+            for i in set(self.pool)-set(keep):
+                logger.info(f'Unload {i}')
+                del self.pool[i]
+class LazyOcr:
+    def __init__(self,pool,lang):
+        self.pool=pool
+        self.lang=lang
+    def __get__(self,obj,owner=None):return getattr(self.pool,self.lang)
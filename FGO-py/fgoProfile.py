@@ -0,0 +1,63 @@
+import importlib,json,os,platform,threading,time
+from fgoConst import VERSION
+
+def rss():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:pass
+    if platform.system()=='Windows':
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):_fields_=[('cb',wintypes.DWORD),('PageFaultCount',wintypes.DWORD)]+[(i,ctypes.c_size_t)for i in('PeakWorkingSetSize','WorkingSetSize','QuotaPeakPagedPoolUsage','QuotaPagedPoolUsage','QuotaPeakNonPagedPoolUsage','QuotaNonPagedPoolUsage','PagefileUsage','PeakPagefileUsage')]
+        counters=PROCESS_MEMORY_COUNTERS(cb=ctypes.sizeof(PROCESS_MEMORY_COUNTERS))
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),ctypes.byref(counters),counters.cb)
+        return counters.WorkingSetSize
+    if os.path.isfile('/proc/self/statm'):
+        with open('/proc/self/statm')as f:return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if platform.system()=='Darwin'else 1024) # peak only
+
+class Profiler:
+    def __init__(self):
+        self.stages=[]
+        self.begin=time.perf_counter()
+        self.rss=rss()
+    def __call__(self,name,func):
+        rssBegin,threadBegin,timer=rss(),threading.active_count(),time.perf_counter()
+        func()
+        self.stages.append({'name':name,'time':time.perf_counter()-timer,'rss':(t:=rss()),'rssDelta':t-rssBegin,'threads':threading.active_count()-threadBegin})
+    def report(self,entrypoint):return{
+        'version':VERSION,
+        'entrypoint':entrypoint,
+        'platform':platform.platform(),
+        'python':platform.python_version(),
+        'time':time.time(),
+        'total':time.perf_counter()-self.begin,
+        'rss':self.rss,
+        'stages':self.stages,
+    }
+
+def profile(entrypoint,file='',region='CN'):
+    profiler=Profiler()
+    module=lambda name:lambda:importlib.import_module(name)
+    profiler('airtest',module('airtest.core.android'))
+    profiler('pponnxcr',module('pponnxcr'))
+    profiler('fgoLogging',module('fgoLogging'))
+    profiler('fgoMetadata',module('fgoMetadata'))
+    profiler('fgoDetect',module('fgoDetect'))
+    import fgoDetect,inspect
+    cls=fgoDetect.XDetect.provider[region] # the one set a connected device loads, CN for any unknown package
+    profiler('fgoDetect.IMG',cls.tmpl.preload)
+    profiler('fgoDetect.OCR',lambda:fgoDetect.OCR.preload('EN',inspect.getattr_static(cls,'ocr').lang))
+    profiler('fgoKernel',module('fgoKernel'))
+    profiler(name:={'gui':'fgoGui','cli':'fgoCli','web':'fgoWebServer'}[entrypoint],module(name))
+    from fgoLogging import getLogger
+    logger=getLogger('Profile')
+    for i in profiler.stages:logger.info(f'{i["name"]:16}{i["time"]*1000:9.1f}ms{i["rssDelta"]/1048576:+9.1f}MiB{i["threads"]:+3}')
+    from fgoAsset import asset,pyramid
+    report=profiler.report(entrypoint)|{'region':region,'asset':asset.stat(),'pyramid':pyramid.stat()}
+    logger.info(f'Asset {report["asset"]["size"]/1048576:.1f}MiB in {report["asset"]["unique"]} arrays, {report["asset"]["saved"]/1048576:.1f}MiB deduplicated')
+    with open(file:=file or time.strftime('fgoLog/Startup_%Y-%m-%d_%H.%M.%S.json'),'w')as f:json.dump(report,f,indent=4)
+    logger.warning(f'Startup {report["total"]*1000:.1f}ms, report saved to {file}')
+    return report
@@ -0,0 +1,90 @@
+import os,socket,threading,time,cv2
+from fgoLogging import getLogger
+logger=getLogger('Stream')
+
+os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS','flags;low_delay|probesize;32|analyzeduration;0') # hand out each frame as soon as it is decoded instead of holding it for reordering, and open on the first packets, as a still screen sends no more
+
+class Stream:
+    # Frames decoded continuously in background, the newest one kept with its timestamp in a single slot
+    # The slot is replaced by one assignment and read without a lock, so taking a screenshot is just an attribute read
+    # source opens a cv2.VideoCapture-like object and is called again whenever the stream ends or breaks
+    # A recording only sends frames on change, so the newest one stands while the object is open and alive, otherwise only a frame from the last stale seconds is handed out
+    stale=1
+    timeout=10
+    def __init__(self,source,name=None):
+        self.source=source
+        self.latest=None
+        self.capture=None
+        self.started=time.time()
+        self.cond=threading.Condition()
+        self.running=True
+        threading.Thread(target=self.decode,daemon=True,name=f'Stream({name})').start()
+    @property
+    def live(self):return self.capture is not None and getattr(self.capture,'alive',True)
+    @property
+    def available(self):return self.running and(self.live or time.time()<max((self.latest or(0,))[0],self.started)+self.timeout)
+    def decode(self):
+        while self.running:
+            try:
+                capture=self.source()
+                try:
+                    self.capture=capture
+                    while self.running and(frame:=capture.read())[0]:
+                        with self.cond:
+                            self.latest=time.time(),frame[1]
+                            self.cond.notify_all()
+                finally:
+                    self.capture=None
+                    capture.release()
+            except Exception as e:logger.warning(f'Stream broken: {e!r}')
+            if self.running:time.sleep(.1)
+    def current(self):return(latest:=self.latest)and(self.live or latest[0]>=time.time()-self.stale)and latest
+    def get(self,timeout=None):
+        if latest:=self.current():return latest
+        deadline=time.time()+(timeout or self.timeout)
+        with self.cond:
+            while not(latest:=self.current()):
+                if(now:=time.time())>=deadline:raise TimeoutError('No frame from stream')
+                self.cond.wait(min(.1,deadline-now)) # liveness changes without a notification
+            return latest
+    def close(self):self.running=False
+
+class Video:
+    # A recorded video replayed at its own frame rate, standing in for the screen of a device
+    def __init__(self,file):
+        self.capture=cv2.VideoCapture(file)
+        self.interval=1/(self.capture.get(cv2.CAP_PROP_FPS)or 30)
+        self.next=time.time()
+    def read(self):
+        time.sleep(max(0,self.next-time.time()))
+        self.next=max(self.next+self.interval,time.time()-self.interval)
+        return self.capture.read()
+    def release(self):self.capture.release()
+
+class Screenrecord:
+    # screenrecord writes raw h264 to stdout, which is served on a loopback socket since cv2 only reads streams from an url
+    # Recording stops after a few minutes, or once a still screen outlasts the read timeout, and Stream opens a new one, the old process killed on release
+    def __init__(self,adb):
+        server=socket.create_server(('127.0.0.1',0))
+        self.proc=proc=adb.start_cmd(['exec-out','screenrecord','--output-format=h264','-'])
+        def pump():
+            try:
+                server.settimeout(10)
+                conn,_=server.accept()
+                with conn:
+                    while data:=proc.stdout.read1(65536):conn.sendall(data)
+            except OSError:pass
+            finally:
+                server.close()
+                proc.kill()
+        def drain(): # adb pipes stderr as well, which would block the recording once full
+            for i in proc.stderr:logger.debug(f'screenrecord: {i.decode(errors="replace").rstrip()}')
+        threading.Thread(target=pump,daemon=True,name='Screenrecord').start()
+        if proc.stderr:threading.Thread(target=drain,daemon=True,name='ScreenrecordStderr').start()
+        self.capture=cv2.VideoCapture(f'tcp://127.0.0.1:{server.getsockname()[1]}',cv2.CAP_FFMPEG,[cv2.CAP_PROP_OPEN_TIMEOUT_MSEC,10000,cv2.CAP_PROP_READ_TIMEOUT_MSEC,10000])
+    @property
+    def alive(self):return self.proc.poll()is None
+    def read(self):return self.capture.read()
+    def release(self):
+        self.proc.kill()
+        self.capture.release()